@@ -1,4 +1,6 @@
-from typing import List, Dict
+from typing import Dict, Iterable, Iterator, List, Optional
+from operator import itemgetter
+import numpy as np
 
 
 def align_speakers_with_text(transcript: List[Dict], diarization: List[Dict]) -> List[Dict]:
@@ -70,3 +72,157 @@ def align_speakers_with_text(transcript: List[Dict], diarization: List[Dict]) ->
         })
     
     return aligned_segments
+
+
+# Сколько слов обрабатывается за один векторный проход: ограничивает размер
+# массивов пар «слово × реплика» при длинных перекрывающихся репликах
+OVERLAP_BLOCK_SIZE = 16384
+
+
+def _best_speakers(w_start: np.ndarray, w_end: np.ndarray,
+                   t_start: np.ndarray, t_end: np.ndarray, t_speaker: np.ndarray,
+                   max_end: np.ndarray, max_end_idx: np.ndarray, n_speakers: int) -> np.ndarray:
+    n_turns = len(t_start)
+    # Кандидаты для слова — реплики [lo, hi): до lo все реплики закончились раньше
+    # начала слова (по накопленному максимуму концов), с hi начинаются после его конца
+    hi = np.searchsorted(t_start, w_end, side="left")
+    lo = np.searchsorted(max_end, w_start, side="right")
+    counts = np.maximum(hi - lo, 0)
+
+    word_idx = np.repeat(np.arange(len(w_start)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    turn_idx = np.repeat(lo, counts) + offsets
+    overlap = (np.minimum(w_end[word_idx], t_end[turn_idx])
+               - np.maximum(w_start[word_idx], t_start[turn_idx]))
+    positive = overlap > 0
+    word_idx, overlap = word_idx[positive], overlap[positive]
+    speaker_idx = t_speaker[turn_idx[positive]]
+
+    # Суммарное перекрытие по паре (слово, спикер), затем спикер с максимумом
+    totals = np.bincount(word_idx * n_speakers + speaker_idx, weights=overlap,
+                         minlength=len(w_start) * n_speakers).reshape(len(w_start), n_speakers)
+    best = np.where(totals.max(axis=1) > 0, totals.argmax(axis=1), -1)
+
+    # Слова в паузах между репликами — ближайшему по времени спикеру
+    missing = np.flatnonzero(best < 0)
+    if missing.size:
+        has_prev = lo[missing] > 0
+        prev_idx = max_end_idx[np.maximum(lo[missing] - 1, 0)]
+        prev_gap = np.where(has_prev, w_start[missing] - max_end[np.maximum(lo[missing] - 1, 0)], np.inf)
+        has_next = hi[missing] < n_turns
+        next_idx = np.minimum(hi[missing], n_turns - 1)
+        next_gap = np.where(has_next, t_start[next_idx] - w_end[missing], np.inf)
+        best[missing] = np.where(prev_gap <= next_gap, t_speaker[prev_idx], t_speaker[next_idx])
+    return best
+
+
+def align_speakers_by_overlap(transcript: List[Dict], diarization: List[Dict],
+                              merge_gap: float = 1.0) -> List[Dict]:
+    if not transcript or not diarization:
+        return []
+
+    # Колонки достаём одним проходом по словарям, сортируем уже массивы
+    w_start = np.array(list(map(itemgetter("start"), transcript)), dtype=float)
+    w_end = np.array(list(map(itemgetter("end"), transcript)), dtype=float)
+    word_order = np.argsort(w_start, kind="stable")
+    w_start, w_end = w_start[word_order], w_end[word_order]
+    n_words = len(w_start)
+
+    t_start = np.array(list(map(itemgetter("start"), diarization)), dtype=float)
+    t_end = np.array(list(map(itemgetter("end"), diarization)), dtype=float)
+    turn_order = np.argsort(t_start, kind="stable")
+    t_start, t_end = t_start[turn_order], t_end[turn_order]
+    speakers, t_speaker = np.unique(list(map(itemgetter("speaker"), diarization)), return_inverse=True)
+    t_speaker = t_speaker[turn_order]
+    speakers = speakers.tolist()
+
+    # Реплики могут перекрываться, поэтому концы не отсортированы — берём накопленный максимум
+    max_end = np.maximum.accumulate(t_end)
+    max_end_idx = np.maximum.accumulate(np.where(t_end == max_end, np.arange(len(t_end)), 0))
+
+    word_speaker = np.concatenate([
+        _best_speakers(w_start[i:i + OVERLAP_BLOCK_SIZE], w_end[i:i + OVERLAP_BLOCK_SIZE],
+                       t_start, t_end, t_speaker, max_end, max_end_idx, len(speakers))
+        for i in range(0, n_words, OVERLAP_BLOCK_SIZE)
+    ])
+
+    # Новый сегмент — при смене спикера или паузе не меньше merge_gap
+    boundaries = np.ones(n_words, dtype=bool)
+    boundaries[1:] = ((word_speaker[1:] != word_speaker[:-1])
+                      | (np.abs(w_start[1:] - w_end[:-1]) >= merge_gap))
+    seg_first = np.flatnonzero(boundaries)
+    seg_last = np.append(seg_first[1:], n_words) - 1
+
+    words = list(map(itemgetter("word"), transcript))
+    words = [words[i] for i in word_order.tolist()]
+    return [
+        {
+            "start": float(w_start[first]),
+            "end": float(w_end[last]),
+            "speaker": speakers[word_speaker[first]],
+            "word": " ".join(words[first:last + 1]).strip()
+        }
+        for first, last in zip(seg_first.tolist(), seg_last.tolist())
+    ]
+
+
+def _nearest_speaker(word: Dict, previous: Optional[Dict], upcoming: Optional[Dict]) -> Optional[str]:
+    previous_gap = word["start"] - previous["end"] if previous else float("inf")
+    upcoming_gap = upcoming["start"] - word["end"] if upcoming else float("inf")
+    if previous is None and upcoming is None:
+        return None
+    return previous["speaker"] if previous_gap <= upcoming_gap else upcoming["speaker"]
+
+
+def iter_aligned_segments(transcript: Iterable[Dict], diarization: Iterable[Dict],
+                          merge_gap: float = 1.0) -> Iterator[Dict]:
+    # Потоковый вариант align_speakers_by_overlap: оба входа уже упорядочены по start,
+    # в памяти только реплики, ещё способные перекрыть текущее слово, и открытый сегмент
+    turns = iter(diarization)
+    upcoming = next(turns, None)
+    active: List[Dict] = []
+    previous = None
+    current = None
+
+    for word in transcript:
+        while upcoming is not None and upcoming["start"] < word["end"]:
+            active.append(upcoming)
+            upcoming = next(turns, None)
+
+        still_active = []
+        for turn in active:
+            if turn["end"] > word["start"]:
+                still_active.append(turn)
+            elif previous is None or turn["end"] >= previous["end"]:
+                previous = turn
+        active = still_active
+
+        totals: Dict[str, float] = {}
+        for turn in active:
+            overlap = min(word["end"], turn["end"]) - max(word["start"], turn["start"])
+            if overlap > 0:
+                totals[turn["speaker"]] = totals.get(turn["speaker"], 0.0) + overlap
+        # При равенстве — меньшая метка, как в align_speakers_by_overlap
+        speaker = max(sorted(totals), key=totals.get) if totals else _nearest_speaker(word, previous, upcoming)
+
+        if (current is not None and speaker == current["speaker"]
+                and abs(word["start"] - current["end"]) < merge_gap):
+            current["words"].append(word["word"])
+            current["end"] = word["end"]
+            continue
+
+        if current is not None:
+            yield _close_segment(current)
+        current = {"start": word["start"], "end": word["end"], "speaker": speaker, "words": [word["word"]]}
+
+    if current is not None:
+        yield _close_segment(current)
+
+
+def _close_segment(segment: Dict) -> Dict:
+    return {
+        "start": segment["start"],
+        "end": segment["end"],
+        "speaker": segment["speaker"],
+        "word": " ".join(segment["words"]).strip()
+    }
@@ -0,0 +1,10 @@
+from dotenv import load_dotenv
+
+# Точка входа API: uvicorn asgi:app. .env читается здесь, до импорта модулей
+# сервиса — они берут настройки из окружения при импорте, а сам web_interface
+# при импорте файлов не читает
+load_dotenv()
+
+from web_interface import create_app
+
+app = create_app()
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import threading
+import json
+import time
+import os
+
+from utils import get_logger
+
+IDENTITY_CACHE_SIZE = int(os.getenv("IDENTITY_CACHE_SIZE", 10000))
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", 3600))
+# Общий кэш для нескольких процессов API; без него кэш только в памяти процесса
+REDIS_URL = os.getenv("REDIS_URL")
+logger = get_logger("cache")
+
+_MISSING = object()
+_redis = None
+
+
+def _get_redis():
+    global _redis
+    if _redis is None and REDIS_URL:
+        import redis
+        _redis = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5)
+    return _redis
+
+
+class TTLCache:
+    # LRU с ограниченным размером и временем жизни записей. Если задан REDIS_URL,
+    # промах в памяти проверяется в Redis, а запись уходит в оба места
+    def __init__(self, name: str, maxsize: int = IDENTITY_CACHE_SIZE, ttl: float = IDENTITY_CACHE_TTL,
+                 shared: bool = True):
+        self.name = name
+        self.shared = shared
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+
+    def _key(self, key) -> str:
+        return f"cache:{self.name}:{key}"
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, expires_at = item
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+        value = self._shared_get(key)
+        if value is not _MISSING:
+            self._local_set(key, value, self.ttl)
+            with self._lock:
+                self.shared_hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        self._local_set(key, value, ttl)
+        redis = _get_redis() if self.shared else None
+        if redis is not None:
+            try:
+                redis.set(self._key(key), json.dumps(value), ex=max(1, int(ttl)))
+            except Exception as e:
+                logger.warning(f"Redis cache set failed: {e}")
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        redis = _get_redis() if self.shared else None
+        if redis is not None:
+            try:
+                redis.delete(self._key(key))
+            except Exception as e:
+                logger.warning(f"Redis cache delete failed: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _local_set(self, key, value, ttl: float):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def _shared_get(self, key):
+        redis = _get_redis() if self.shared else None
+        if redis is None:
+            return _MISSING
+        try:
+            raw = redis.get(self._key(key))
+        except Exception as e:
+            # Недоступный Redis не должен ронять запрос — идём в базу
+            logger.warning(f"Redis cache get failed: {e}")
+            return _MISSING
+        return _MISSING if raw is None else json.loads(raw)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
+
+
+# Соответствие user_id -> telegram_id не меняется — поэтому TTL может быть длинным
+telegram_id_cache = TTLCache("telegram_id")
+# Разобранные access-токены: только in-process, в Redis сами токены не кладём
+token_cache = TTLCache("token", ttl=float(os.getenv("TOKEN_CACHE_TTL", 300)), shared=False)
+
+
+def cache_stats() -> Dict[str, Dict]:
+    return {cache.name: cache.stats() for cache in (telegram_id_cache, token_cache)}
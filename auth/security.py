@@ -4,6 +4,8 @@ from jose import jwt, JWTError
 import os
 from typing import Optional
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from auth.cache import token_cache
+import time
 
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY") or "change_me_in_prod"
 JWT_ALGORITHM = "HS256"
@@ -44,9 +46,18 @@ def _decode_token(token: str) -> dict:
 
 
 def verify_access_token(token: str) -> str:
+    # Дашборд шлёт один и тот же токен на каждый запрос — подпись проверяем один раз
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
     payload = _decode_token(token)
     if payload.get("type") != "access":
         raise HTTPException(status_code=403, detail="Неверный тип токена")
+    ttl = None
+    if "exp" in payload:
+        # Запись в кэше не должна пережить сам токен
+        ttl = min(token_cache.ttl, payload["exp"] - time.time())
+    token_cache.set(token, payload["sub"], ttl)
     return payload["sub"]
 
 
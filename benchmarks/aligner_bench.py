@@ -0,0 +1,94 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aligner import align_speakers_with_text, align_speakers_by_overlap
+
+
+def make_call(n_words: int, n_speakers: int, seed: int):
+    # Синтетический звонок: реплики по 2–20 с, иногда с перекрытием соседей,
+    # слова по 0.2–0.6 с с короткими паузами
+    rng = random.Random(seed)
+    words, t = [], 0.0
+    for i in range(n_words):
+        t += rng.uniform(0.02, 0.3)
+        length = rng.uniform(0.2, 0.6)
+        words.append({"word": f"w{i}", "start": t, "end": t + length})
+        t += length
+    duration = t
+
+    turns, t = [], 0.0
+    while t < duration:
+        length = rng.uniform(2, 20)
+        overlap = rng.uniform(0, 1.5) if rng.random() < 0.2 else 0.0
+        start = max(0.0, t - overlap)
+        turns.append({"start": start, "end": t + length, "speaker": f"SPEAKER_{rng.randrange(n_speakers):02d}"})
+        t += length + rng.uniform(0, 0.5)
+    return words, turns
+
+
+def true_speakers(words, turns):
+    # Эталон: спикер реплики с наибольшим перекрытием со словом (перебор соседних реплик).
+    # Слова с равным перекрытием у двух спикеров неоднозначны и в точность не входят
+    truth, j = [], 0
+    for word in words:
+        while j < len(turns) and turns[j]["end"] < word["start"] - 30:
+            j += 1
+        best, best_overlap, tie = None, 0.0, False
+        for turn in turns[j:]:
+            if turn["start"] > word["end"]:
+                break
+            overlap = min(word["end"], turn["end"]) - max(word["start"], turn["start"])
+            if overlap > best_overlap:
+                best, best_overlap, tie = turn["speaker"], overlap, False
+            elif overlap == best_overlap and overlap > 0 and turn["speaker"] != best:
+                tie = True
+        truth.append(None if tie else best)
+    return truth
+
+
+def accuracy(segments, truth) -> float:
+    # Синтетические слова вида "w123" — по ним восстанавливаем спикера каждого слова
+    assigned = [None] * len(truth)
+    for segment in segments:
+        for token in segment["word"].split():
+            assigned[int(token[1:])] = segment["speaker"]
+    return sum(a == t for a, t in zip(assigned, truth) if t is not None) / sum(t is not None for t in truth)
+
+
+def bench(fn, words, turns, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(words, turns)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение align_speakers_with_text и align_speakers_by_overlap")
+    parser.add_argument("--words", type=int, nargs="+", default=[1000, 10000, 50000, 200000])
+    parser.add_argument("--speakers", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'words':>8} {'turns':>7} {'legacy, s':>10} {'overlap, s':>11} {'speedup':>8} "
+          f"{'legacy acc':>11} {'overlap acc':>12}")
+    for n_words in args.words:
+        words, turns = make_call(n_words, args.speakers, args.seed)
+        truth = true_speakers(words, turns)
+        legacy = bench(align_speakers_with_text, words, turns, args.repeat)
+        vectorized = bench(align_speakers_by_overlap, words, turns, args.repeat)
+        legacy_acc = accuracy(align_speakers_with_text(words, turns), truth)
+        vectorized_acc = accuracy(align_speakers_by_overlap(words, turns), truth)
+        print(f"{n_words:>8} {len(turns):>7} {legacy:>10.4f} {vectorized:>11.4f} {legacy / vectorized:>7.1f}x "
+              f"{legacy_acc:>11.2%} {vectorized_acc:>12.2%}")
+
+
+if __name__ == "__main__":
+    main()
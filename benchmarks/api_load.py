@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+async def worker(client: httpx.AsyncClient, method: str, path: str, body, deadline: float, latencies: list, errors: list):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, json=body)
+            if response.status_code >= 400:
+                errors.append(response.status_code)
+        except httpx.HTTPError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(args):
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    body = json.loads(args.body) if args.body else None
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    latencies, errors = [], []
+    async with httpx.AsyncClient(base_url=args.url, headers=headers, limits=limits, timeout=30) as client:
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*(
+            worker(client, args.method, args.path, body, deadline, latencies, errors)
+            for _ in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    print(f"{args.method} {args.path}: {len(latencies)} запросов за {elapsed:.1f} с, "
+          f"{len(latencies) / elapsed:.0f} QPS, ошибок {len(errors)}")
+    print(f"латентность, мс: p50 {quantiles[49] * 1000:.1f}  p95 {quantiles[94] * 1000:.1f}  "
+          f"p99 {quantiles[98] * 1000:.1f}  max {latencies[-1] * 1000:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API на локальной базе")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--path", required=True, help="например /status/<task_id>")
+    parser.add_argument("--body", help="JSON-тело для POST")
+    parser.add_argument("--token", help="SERVICE_API_TOKEN или access-токен пользователя")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Модули, которые не должны загружаться при импорте точек входа:
+# SDK и модели подгружаются при первом использовании или только в процессах пулов
+HEAVY_MODULES = ("torch", "pyannote", "scipy", "openai", "supabase", "docx", "lxml")
+# Переменная из .env в каталоге замера: видно, читает ли модуль .env при импорте
+ENV_PROBE = "IMPORT_BUDGET_DOTENV"
+
+PROBE = """
+import json, os, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "heavy": [name for name in {heavy!r} if name in sys.modules],
+    "created": sorted(set(os.listdir(".")) - {{".env"}}),
+    "dotenv": {env!r} in os.environ,
+}}))
+"""
+
+
+def probe(module: str) -> dict:
+    # Каждый замер — в чистом интерпретаторе и пустом каталоге: видно и время,
+    # и файлы, которые модуль создаёт при импорте
+    with tempfile.TemporaryDirectory() as cwd:
+        with open(os.path.join(cwd, ".env"), "w") as f:
+            f.write(f"{ENV_PROBE}=1\n")
+        env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE="1")
+        env.pop(ENV_PROBE, None)
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES, env=ENV_PROBE)],
+            cwd=cwd, env=env, capture_output=True, text=True, check=True
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время импорта API и воркера и отсутствие тяжёлых модулей")
+    parser.add_argument("--api-budget", type=float, default=1.0, help="бюджет на import web_interface, с")
+    parser.add_argument("--worker-budget", type=float, default=1.0, help="бюджет на import main, с")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    violations = []
+    report = {}
+    for module, budget in (("web_interface", args.api_budget), ("main", args.worker_budget)):
+        runs = [probe(module) for _ in range(args.repeat)]
+        best = min(run["seconds"] for run in runs)
+        report[module] = {"seconds": round(best, 3), "budget": budget, "heavy": runs[0]["heavy"],
+                          "created": runs[0]["created"], "dotenv": runs[0]["dotenv"]}
+        if best > budget:
+            violations.append(f"{module}: импорт {best:.3f} с при бюджете {budget} с")
+        if runs[0]["heavy"]:
+            violations.append(f"{module}: при импорте загружены {', '.join(runs[0]['heavy'])}")
+        if runs[0]["created"]:
+            violations.append(f"{module}: при импорте созданы {', '.join(runs[0]['created'])}")
+        # .env API читает точка входа asgi; main сам является точкой входа воркера
+        if module == "web_interface" and runs[0]["dotenv"]:
+            violations.append(f"{module}: при импорте прочитан .env")
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    for violation in violations:
+        print(violation, file=sys.stderr)
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
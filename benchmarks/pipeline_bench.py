@@ -0,0 +1,345 @@
+import argparse
+import asyncio
+import functools
+import http.server
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SOURCE_SAMPLE_RATE = 44100
+WORD_SECONDS = 0.4
+
+
+def make_call(duration: float, n_speakers: int, seed: int):
+    # Разметка синтетического звонка: реплики по 2–15 с с паузами, слова по 0.4 с
+    rng = random.Random(seed)
+    turns, words, t = [], [], 0.0
+    while t < duration:
+        length = min(rng.uniform(2, 15), duration - t)
+        speaker = f"SPEAKER_{rng.randrange(n_speakers):02d}"
+        turns.append({"start": t, "end": t + length, "speaker": speaker})
+        w = t
+        while w + WORD_SECONDS <= t + length:
+            words.append({"word": f" w{len(words)}", "start": w, "end": w + WORD_SECONDS * 0.8})
+            w += WORD_SECONDS
+        t += length + rng.uniform(0.2, 1.0)
+    return words, turns
+
+
+def write_call_audio(path: str, duration: float, turns, n_speakers: int, seed: int):
+    # 44.1 кГц стерео, чтобы preprocess делал настоящее перекодирование.
+    # У каждого спикера своя основная частота, «слоги» — амплитудная модуляция 4 Гц
+    rng = np.random.default_rng(seed)
+    pitches = [110 + 60 * i for i in range(n_speakers)]
+    total = int(duration * SOURCE_SAMPLE_RATE)
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(2)
+        wf.setsampwidth(2)
+        wf.setframerate(SOURCE_SAMPLE_RATE)
+        written = 0
+        for turn in turns:
+            start = int(turn["start"] * SOURCE_SAMPLE_RATE)
+            end = min(int(turn["end"] * SOURCE_SAMPLE_RATE), total)
+            if start > written:
+                silence = rng.normal(0, 30, start - written)
+                wf.writeframes(np.repeat(silence.astype(np.int16), 2).tobytes())
+            t = np.arange(end - start) / SOURCE_SAMPLE_RATE
+            f0 = pitches[int(turn["speaker"].split("_")[1])]
+            voice = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 5))
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+            samples = 6000 * voice * envelope + rng.normal(0, 200, len(t))
+            wf.writeframes(np.repeat(samples.astype(np.int16), 2).tobytes())
+            written = end
+        if total > written:
+            wf.writeframes(np.zeros(2 * (total - written), dtype=np.int16).tobytes())
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_directory(directory: str) -> http.server.ThreadingHTTPServer:
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def install_fake_diarization(turns, args):
+    # Настоящий модуль тянет pyannote и torch; подменяем его целиком до импорта main
+    fake = types.ModuleType("diarization")
+    fake.DIARIZATION_POOL_SIZE = 1
+
+    async def diarize_audio(audio_path, duration=None, on_progress=None):
+        await asyncio.sleep(args.diarize_latency + args.diarize_rtf * (duration or 0))
+        return [dict(turn) for turn in turns]
+
+    async def noop_async(*_, **__):
+        return True
+
+    fake.diarize_audio = diarize_audio
+    fake.start_diarization_pool = fake.stop_diarization_pool = fake.restart_diarization_pool = lambda *_, **__: None
+    fake.warmup_diarization_pool = fake.check_diarization_pool = noop_async
+    fake.diarization_pool_busy = lambda: False
+    sys.modules["diarization"] = fake
+
+
+class FakeDatabase:
+    # Задачи в памяти; задержка — синхронный sleep, как у настоящих вызовов psycopg2 в цикле событий
+    def __init__(self, tasks, latency: float):
+        self.queue = list(tasks)
+        self.latency = latency
+        self.finished = 0
+        self.failures = []
+        self.all_done = asyncio.Event()
+        self.total = len(tasks)
+
+    def call(self, result=None):
+        def fake(*_, **__):
+            time.sleep(self.latency)
+            return result
+        return fake
+
+    def claim_task(self, *_):
+        time.sleep(self.latency)
+        return self.queue.pop(0) if self.queue else None
+
+    def publish_progress(self, task_id, stage, progress=None, status=None):
+        time.sleep(self.latency)
+        if status is not None and status.value == "FINISHED":
+            self.task_done()
+
+    def extend_task_leases(self, task_ids, *_):
+        time.sleep(self.latency)
+        return task_ids
+
+    def release_task(self, task_id, worker_id, error, *_):
+        # Воркер отпускает задачу один раз, после всех повторов стадии, — здесь и считаем отказ.
+        # Обратно в очередь не ставим: упавшая задача тоже завершает прогон
+        from schema import TaskStatus
+        time.sleep(self.latency)
+        self.failures.append(error)
+        self.task_done()
+        return TaskStatus.failed
+
+    def task_done(self):
+        self.finished += 1
+        if self.finished >= self.total:
+            self.all_done.set()
+
+
+class FakeStorage:
+    def __init__(self, latency: float, bandwidth_mb: float):
+        self.latency = latency
+        self.bandwidth = bandwidth_mb * 1024 * 1024
+        self.results = {}
+        self.uploaded_bytes = 0
+        self.parts = 0
+        self._lock = threading.Lock()
+
+    def upload_bytes(self, data, bucket, dest_name, content_type="application/octet-stream", *_, **__):
+        time.sleep(self.latency + len(data) / self.bandwidth)
+        with self._lock:
+            self.uploaded_bytes += len(data)
+            if dest_name.count("/") == 1:
+                self.results[dest_name] = data
+            elif not dest_name.endswith("/manifest.json"):
+                self.parts += 1
+        return f"https://storage.local/{bucket}/{dest_name}"
+
+
+def timed(name: str, handler, timings):
+    async def wrapper(job):
+        started = time.perf_counter()
+        try:
+            return await handler(job)
+        finally:
+            timings.setdefault(name, []).append(time.perf_counter() - started)
+    return wrapper
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    quantiles = statistics.quantiles(samples, n=20) if len(samples) > 1 else samples * 19
+    return {
+        "count": len(samples),
+        "total_s": round(sum(samples), 4),
+        "mean_s": round(statistics.fmean(samples), 4),
+        "p50_s": round(statistics.median(samples), 4),
+        "p95_s": round(quantiles[18], 4),
+        "max_s": round(samples[-1], 4),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def run(args, workdir: str):
+    words, turns = make_call(args.duration, args.speakers, args.seed)
+    source_dir = os.path.join(workdir, "source")
+    os.makedirs(source_dir)
+    started = time.perf_counter()
+    write_call_audio(os.path.join(source_dir, "call.wav"), args.duration, turns, args.speakers, args.seed)
+    generation_s = time.perf_counter() - started
+    server = serve_directory(source_dir)
+
+    install_fake_diarization(turns, args)
+    import main as worker
+    import partial_results
+    import checkpoints
+    from schema import Task, TaskStatus
+
+    url = f"http://127.0.0.1:{server.server_address[1]}/call.wav"
+    # Одно имя файла у всех задач, как у повторно присланного звонка
+    tasks = [Task(id=f"bench-{i}", file_url=url, file_name="call.wav",
+                  status=TaskStatus.running, telegram_id=1) for i in range(args.tasks)]
+    db = FakeDatabase(tasks, args.db_latency)
+    storage = FakeStorage(args.upload_latency, args.upload_bandwidth)
+
+    async def transcribe_audio(audio_path, duration=None, on_chunk=None, **_):
+        # Куски по --chunk-seconds распознаются параллельно, как в transcription_chunked
+        duration = duration or 0.0
+        total = max(1, math.ceil(duration / args.chunk_seconds))
+        cuts = [min(duration, i * args.chunk_seconds) for i in range(total)] + [duration]
+
+        async def chunk(i):
+            await asyncio.sleep(args.transcribe_latency + args.transcribe_rtf * (cuts[i + 1] - cuts[i]))
+            owned = [dict(word) for word in words
+                     if cuts[i] <= word["start"] and (word["start"] < cuts[i + 1] or i == total - 1)]
+            if on_chunk is not None:
+                await on_chunk(i, total, cuts[i], cuts[i + 1], owned)
+            return owned
+
+        return [word for owned in await asyncio.gather(*(chunk(i) for i in range(total))) for word in owned]
+
+    async def wait_for_task_notification(timeout):
+        await asyncio.sleep(min(timeout, 0.05))
+        return False
+
+    worker.PATH_TO_AUDIO_FILES = os.path.join(workdir, "audio_to_process")
+    os.makedirs(worker.PATH_TO_AUDIO_FILES)
+    worker.PARTIAL_RESULTS = args.partial
+    checkpoints.CHECKPOINT_DIR = os.path.join(workdir, "checkpoints")
+    worker.transcribe_audio = transcribe_audio
+    worker.init_db_client = worker.listen_for_tasks = lambda: None
+    worker.claim_task = db.claim_task
+    worker.wait_for_task_notification = wait_for_task_notification
+    worker.publish_progress = db.publish_progress
+    worker.get_cached_result = worker.get_task = db.call(None)
+    worker.purge_result_cache = db.call(0)
+    worker.extend_task_leases = db.extend_task_leases
+    worker.release_task = db.release_task
+    worker.reap_expired_tasks = worker.resume_tasks = db.call([])
+    worker.WORKER_METRICS_PORT = 0
+    for name in ("set_task_result_url", "set_task_manifest_url", "save_cached_result",
+                 "index_transcript", "copy_transcript_index", "save_task_timings"):
+        setattr(worker, name, db.call())
+    worker.upload_bytes_to_supabase = partial_results.upload_bytes_to_supabase = storage.upload_bytes
+
+    timings = {}
+    for stage in ("download", "preprocess", "infer", "upload"):
+        setattr(worker, stage, timed(stage, getattr(worker, stage), timings))
+
+    started = time.perf_counter()
+    pipeline = asyncio.create_task(worker.main())
+    waiter = asyncio.create_task(db.all_done.wait())
+    await asyncio.wait([pipeline, waiter], return_when=asyncio.FIRST_COMPLETED)
+    wall_s = time.perf_counter() - started
+    pipeline.cancel()
+    try:
+        await pipeline
+    except (asyncio.CancelledError, Exception):
+        pass
+    server.shutdown()
+
+    export = None
+    if args.export and storage.results:
+        from convert import render_dialog
+        from transcript_format import load_transcript
+        export_times = []
+        for name, data in sorted(storage.results.items())[:args.export]:
+            started = time.perf_counter()
+            render_dialog(load_transcript(data), os.path.join(workdir, os.path.basename(name)))
+            export_times.append(time.perf_counter() - started)
+        export = summarize(export_times)
+
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {
+        "revision": git_revision(),
+        "config": vars(args),
+        "audio": {"duration_s": args.duration, "words": len(words), "turns": len(turns),
+                  "generation_s": round(generation_s, 3)},
+        "tasks": args.tasks,
+        "finished": db.finished - len(db.failures),
+        "failed": len(db.failures),
+        "errors": db.failures[:10],
+        "wall_s": round(wall_s, 3),
+        "tasks_per_minute": round(args.tasks / wall_s * 60, 2),
+        "stages": {name: summarize(samples) for name, samples in timings.items()},
+        "export_docx": export,
+        "uploaded_mb": round(storage.uploaded_bytes / 1024 / 1024, 3),
+        "partial_parts": storage.parts,
+        # ru_maxrss в Linux — килобайты; у дочерних процессов (ffmpeg) — максимум по одному
+        "peak_rss_mb": round(own / 1024, 1),
+        "children_peak_rss_mb": round(children / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Офлайн-бенчмарк конвейера воркера: настоящие download/preprocess/выравнивание/экспорт, "
+                    "локальные заглушки базы, Whisper, pyannote и Supabase"
+    )
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=300, help="длина синтетической записи, с")
+    parser.add_argument("--speakers", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--transcribe-latency", type=float, default=0.5, help="фиксированная задержка Whisper, с")
+    parser.add_argument("--transcribe-rtf", type=float, default=0.01, help="секунд ответа на секунду аудио")
+    parser.add_argument("--chunk-seconds", type=float, default=60, help="длина куска транскрибации, с")
+    parser.add_argument("--diarize-latency", type=float, default=0.5)
+    parser.add_argument("--diarize-rtf", type=float, default=0.02)
+    parser.add_argument("--db-latency", type=float, default=0.002, help="задержка одного запроса к базе, с")
+    parser.add_argument("--upload-latency", type=float, default=0.05)
+    parser.add_argument("--upload-bandwidth", type=float, default=50, help="МБ/с")
+    parser.add_argument("--partial", action="store_true", help="публиковать частичные результаты")
+    parser.add_argument("--export", type=int, default=3, help="сколько результатов выгрузить в DOCX (0 — не выгружать)")
+    parser.add_argument("--output", help="куда сохранить JSON с результатами")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pipeline-bench-")
+    try:
+        report = asyncio.run(run(args, workdir))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
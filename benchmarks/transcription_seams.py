@@ -0,0 +1,152 @@
+import argparse
+import asyncio
+import functools
+import os
+import random
+import sys
+import tempfile
+import wave
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transcription
+
+SAMPLE_RATE = 16000
+WORD_SECONDS = 0.4
+
+
+def make_words(duration: float):
+    # Сплошная речь без пауз: разрез куска всегда приходится на слово
+    words, t = [], 0.0
+    while t + WORD_SECONDS <= duration:
+        words.append({"word": f" w{len(words)}", "start": t, "end": t + WORD_SECONDS * 0.8})
+        t += WORD_SECONDS
+    return words
+
+
+def write_noise(path: str, duration: float, seed: int):
+    rng = np.random.default_rng(seed)
+    samples = (rng.normal(0, 3000, int(duration * SAMPLE_RATE))).clip(-32768, 32767).astype(np.int16)
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(samples.tobytes())
+
+
+def stub_endpoint(words, jitter: float, seed: int):
+    # Заглушка Whisper: слова, попавшие в кусок, с таймкодами, сдвинутыми
+    # на случайную величину отдельно для каждого куска — как у настоящего API на стыках
+    rng = random.Random(seed)
+
+    async def transcribe_chunk(client, semaphore, audio_path, start, end):
+        async with semaphore:
+            await asyncio.sleep(0)
+        result = []
+        for word in words:
+            shift = rng.uniform(-jitter, jitter)
+            if start <= word["start"] and word["end"] <= end:
+                result.append({**word, "start": word["start"] + shift, "end": word["end"] + shift})
+        return result
+    return transcribe_chunk
+
+
+def check_cut_case() -> list:
+    # Слово на разрезе: первый кусок видит его после разреза, второй — до
+    cuts = [0.0, 10.0, 20.0]
+    merged = transcription.merge_chunk_words(cuts, [
+        [{"word": " x", "start": 10.02, "end": 10.3}],
+        [{"word": " x", "start": 9.98, "end": 10.3}],
+    ])
+    errors = []
+    if [w["word"] for w in merged] != [" x"]:
+        errors.append(f"слово на разрезе: ожидалось [' x'], получено {merged}")
+    return errors
+
+
+async def check_chunked(duration: float, seed: int, jitter: float) -> list:
+    words = make_words(duration)
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "call.wav")
+        write_noise(path, duration, seed)
+        transcription._transcribe_chunk = stub_endpoint(words, jitter, seed)
+        merged = await transcription.transcription_chunked(path)
+    expected = [w["word"] for w in words]
+    got = [w["word"] for w in merged]
+    if got == expected:
+        return []
+    missing = sorted(set(expected) - set(got), key=expected.index)
+    duplicated = sorted({w for w in got if got.count(w) > 1}, key=expected.index)
+    return [f"seed {seed}: потеряно {missing[:5]}, повторено {duplicated[:5]}"]
+
+
+async def check_resume(duration: float, seed: int, jitter: float) -> list:
+    # Сбой на одном куске: повтор отправляет в API только несохранённые куски
+    words = make_words(duration)
+    store, calls = {}, []
+    endpoint = stub_endpoint(words, jitter, seed)
+
+    async def flaky(client, semaphore, audio_path, start, end):
+        calls.append(start)
+        if len(calls) == 3:
+            raise ConnectionError("429")
+        return await endpoint(client, semaphore, audio_path, start, end)
+
+    def load_chunk(index, start, end):
+        return store.get((index, start, end))
+
+    def save_chunk(index, start, end, chunk_words):
+        store[(index, start, end)] = chunk_words
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "call.wav")
+        write_noise(path, duration, seed)
+        transcription._transcribe_chunk = flaky
+        try:
+            await transcription.transcription_chunked(path, max_in_flight=1,
+                                                      load_chunk=load_chunk, save_chunk=save_chunk)
+            return [f"seed {seed}: сбой куска не дошёл до вызывающего"]
+        except ConnectionError:
+            pass
+        saved, first_calls = len(store), len(calls)
+        merged = await transcription.transcription_chunked(path, max_in_flight=1,
+                                                           load_chunk=load_chunk, save_chunk=save_chunk)
+    chunks = len(store)
+    errors = []
+    if len(calls) - first_calls != chunks - saved:
+        errors.append(f"seed {seed}: повтор запросил {len(calls) - first_calls} кусков из {chunks}, "
+                      f"несохранённых было {chunks - saved}")
+    if [w["word"] for w in merged] != [w["word"] for w in words]:
+        errors.append(f"seed {seed}: после повтора слова склеены с ошибками")
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Склейка слов кусков транскрибации на стыках с заглушкой API")
+    parser.add_argument("--duration", type=float, default=180)
+    parser.add_argument("--chunk", type=float, default=20, help="TRANSCRIPTION_CHUNK_SECONDS")
+    parser.add_argument("--jitter", type=float, default=0.05, help="расхождение таймкодов между кусками, с")
+    parser.add_argument("--seeds", type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_KEY", "stub")
+    # Короткие куски, чтобы на записи было много стыков
+    transcription.plan_chunks = functools.partial(
+        transcription.plan_chunks, chunk_seconds=args.chunk, search_seconds=args.chunk / 4
+    )
+
+    errors = check_cut_case()
+    for seed in range(args.seeds):
+        errors += asyncio.run(check_chunked(args.duration, seed, args.jitter))
+        errors += asyncio.run(check_resume(args.duration, seed, args.jitter))
+
+    for error in errors:
+        print(error, file=sys.stderr)
+    print(f"проверено прогонов: {2 * args.seeds + 1}, ошибок: {len(errors)}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+from typing import Any, List, Optional
+import shutil
+import json
+import time
+import os
+
+# Результаты стадий задачи: checkpoints/<task_id>/{meta,turns,words}.json,
+# слова кусков транскрибации chunk-NNNN.json и audio.wav.
+# Каталог должен переживать перезапуск воркера (volume, а не tmpfs контейнера)
+CHECKPOINT_DIR = os.getenv("CHECKPOINT_DIR", "checkpoints")
+CHECKPOINT_RETENTION_HOURS = float(os.getenv("CHECKPOINT_RETENTION_HOURS", 72))
+AUDIO_FILE = "audio.wav"
+
+
+def task_dir(task_id) -> str:
+    return os.path.join(CHECKPOINT_DIR, str(task_id))
+
+
+def save(task_id, name: str, value: Any):
+    # Пишем во временный файл и переименовываем: после падения посреди записи
+    # остаётся прошлая версия или ничего, но не обрезанный JSON
+    os.makedirs(task_dir(task_id), exist_ok=True)
+    path = os.path.join(task_dir(task_id), f"{name}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load(task_id, name: str) -> Optional[Any]:
+    try:
+        with open(os.path.join(task_dir(task_id), f"{name}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def keep_audio(task_id, path: str) -> str:
+    # Подготовленное аудио переносится в каталог задачи и живёт до её завершения
+    os.makedirs(task_dir(task_id), exist_ok=True)
+    kept = os.path.join(task_dir(task_id), AUDIO_FILE)
+    if os.path.abspath(path) != os.path.abspath(kept):
+        shutil.move(path, kept)
+    return kept
+
+
+def audio_path(task_id) -> Optional[str]:
+    path = os.path.join(task_dir(task_id), AUDIO_FILE)
+    return path if os.path.exists(path) else None
+
+
+def list_tasks() -> List[str]:
+    if not os.path.isdir(CHECKPOINT_DIR):
+        return []
+    return [entry.name for entry in os.scandir(CHECKPOINT_DIR) if entry.is_dir()]
+
+
+def remove(task_id):
+    shutil.rmtree(task_dir(task_id), ignore_errors=True)
+
+
+def purge(retention_hours: float = CHECKPOINT_RETENTION_HOURS) -> int:
+    # Брошенные задачи (удалены из базы, не перезапущены) не должны копить аудио на диске
+    deadline = time.time() - retention_hours * 3600
+    purged = 0
+    for task_id in list_tasks():
+        if os.stat(task_dir(task_id)).st_mtime < deadline:
+            remove(task_id)
+            purged += 1
+    return purged
@@ -1,19 +1,58 @@
 from docx import Document
 from docx.shared import Pt, Cm
 from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.oxml import OxmlElement
+from docx.text.paragraph import Paragraph
 import json
 from datetime import datetime
-from typing import Literal, Optional, Dict
+from typing import Dict, Iterable, Literal, Optional
+import subprocess
+import tempfile
+import shutil
 import os
-from doc2pdf import convert
 
+SOFFICE_BINARY = os.getenv("SOFFICE_BINARY", "soffice")
+EXPORT_PDF_TIMEOUT = float(os.getenv("EXPORT_PDF_TIMEOUT", 300))
 
-def export_dialog(
-    input_json: str,
+
+def _add_paragraph(doc, anchor) -> Paragraph:
+    # doc.add_paragraph() на каждый абзац ищет sectPr среди всех детей body —
+    # на длинной расшифровке это квадратично. Вставляем перед sectPr напрямую
+    p = OxmlElement('w:p')
+    if anchor is not None:
+        anchor.addprevious(p)
+    else:
+        doc.element.body.append(p)
+    return Paragraph(p, doc._body)
+
+
+def _docx_to_pdf(docx_path: str, pdf_path: str):
+    # Свой профиль LibreOffice на процесс: параллельные soffice с общим профилем
+    # мешают друг другу и молча ничего не конвертируют
+    profile = os.path.join(tempfile.gettempdir(), f"laterlistener-soffice-{os.getpid()}")
+    outdir = tempfile.mkdtemp()
+    try:
+        result = subprocess.run(
+            [SOFFICE_BINARY, f"-env:UserInstallation=file://{profile}", "--headless",
+             "--convert-to", "pdf", "--outdir", outdir, docx_path],
+            capture_output=True, timeout=EXPORT_PDF_TIMEOUT
+        )
+        converted = os.path.join(outdir, f"{os.path.splitext(os.path.basename(docx_path))[0]}.pdf")
+        if result.returncode != 0 or not os.path.exists(converted):
+            error_output = result.stderr[-2000:].decode("utf-8", errors="replace")
+            raise RuntimeError(f"soffice не смог сконвертировать {docx_path}: {error_output.strip()}")
+        shutil.move(converted, pdf_path)
+    finally:
+        shutil.rmtree(outdir, ignore_errors=True)
+
+
+def render_dialog(
+    dialog: Iterable[Dict],
+    base_path: str,
     speaker_names: Optional[Dict[str, str]] = None,
     file_format: Literal['docx', 'pdf'] = 'docx',
 ) -> str:
-    
+
     font_name: str = 'Times New Roman'
     speaker_fs: int = 16
     text_fs: int = 14
@@ -22,11 +61,8 @@ def export_dialog(
     first_line_indent = Cm(1.25)
     space = Pt(0)
 
-    with open(input_json, 'r', encoding='utf-8') as f:
-        dialog = json.load(f)
-
     doc = Document()
-    
+
     # Настройки стиля по ГОСТ
     style = doc.styles['Normal']
     style.font.name = font_name
@@ -37,20 +73,22 @@ def export_dialog(
     paragraph_format = style.paragraph_format
     paragraph_format.line_spacing = line_spacing
     paragraph_format.first_line_indent = first_line_indent
-    
-    date_para = doc.add_paragraph()
+
+    anchor = doc.element.body.sectPr
+
+    date_para = _add_paragraph(doc, anchor)
     date_para.alignment = WD_PARAGRAPH_ALIGNMENT.RIGHT
     date_run = date_para.add_run(datetime.now().strftime("%d.%m.%Y"))
     date_run.font.size = Pt(time_fs)
 
     for turn in dialog:
         # Обработка имен спикера
-        speaker = turn['speaker']
+        speaker = turn.get('speaker') or ''
         if speaker_names and speaker in speaker_names:
             speaker = speaker_names[speaker]
-        
+
         # Спикер
-        p_speaker = doc.add_paragraph()
+        p_speaker = _add_paragraph(doc, anchor)
         p_speaker.paragraph_format.space_before = space
         p_speaker.paragraph_format.space_after = space
         p_speaker.paragraph_format.first_line_indent = first_line_indent
@@ -59,31 +97,41 @@ def export_dialog(
         speaker_run.bold = True
         speaker_run.font.size = Pt(speaker_fs)
 
-        # Текст
-        p_text = doc.add_paragraph()
+        # Текст: в результатах воркера реплика лежит в поле word
+        p_text = _add_paragraph(doc, anchor)
         p_text.paragraph_format.line_spacing = line_spacing
         p_text.paragraph_format.space_before = space
         p_text.paragraph_format.space_after = space
-        p_text.add_run("— ").bold = True  
-        text_run = p_text.add_run(turn['text'])
+        p_text.add_run("— ").bold = True
+        text_run = p_text.add_run(turn.get('text', turn.get('word', '')).strip())
         text_run.font.size = Pt(text_fs)
 
-    base_name = os.path.splitext(input_json)[0]
-    docx_path = f"{base_name}.docx"
-    
+    docx_path = f"{base_path}.docx"
+
     doc.save(docx_path)
-    
+
     if file_format == 'pdf':
-        pdf_path = f"{base_name}.pdf"
-        convert(docx_path, pdf_path)
+        pdf_path = f"{base_path}.pdf"
+        _docx_to_pdf(docx_path, pdf_path)
         return pdf_path
-    
+
     return docx_path
 
 
-# Пример
-export_dialog(
-    input_json="test.json",
-    speaker_names={'SPEAKER_02': 'Алёша', 'SPEAKER_01': 'Мария'},
-    file_format="pdf"
-)
\ No newline at end of file
+def export_dialog(
+    input_json: str,
+    speaker_names: Optional[Dict[str, str]] = None,
+    file_format: Literal['docx', 'pdf'] = 'docx',
+) -> str:
+    with open(input_json, 'r', encoding='utf-8') as f:
+        dialog = json.load(f)
+    return render_dialog(dialog, os.path.splitext(input_json)[0], speaker_names, file_format)
+
+
+if __name__ == '__main__':
+    # Пример
+    export_dialog(
+        input_json="test.json",
+        speaker_names={'SPEAKER_02': 'Алёша', 'SPEAKER_01': 'Мария'},
+        file_format="pdf"
+    )
@@ -1,16 +1,52 @@
-from typing import Dict, List
-from pyannote.audio import Pipeline, Audio
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import multiprocessing
+import asyncio
 import os
 
+DIARIZATION_MODEL = "pyannote/speaker-diarization-3.1"
+DIARIZATION_POOL_SIZE = int(os.getenv("DIARIZATION_POOL_SIZE", 1))
+# 0 — поделить ядра поровну между процессами пула
+DIARIZATION_TORCH_THREADS = int(os.getenv("DIARIZATION_TORCH_THREADS", 0))
+DIARIZATION_HEALTH_TIMEOUT = float(os.getenv("DIARIZATION_HEALTH_TIMEOUT", 30))
+# Длинные записи диаризуются окнами с перекрытием — память не растёт с длиной звонка
+DIARIZATION_WINDOW_SECONDS = float(os.getenv("DIARIZATION_WINDOW_SECONDS", 600))
+DIARIZATION_WINDOW_OVERLAP = float(os.getenv("DIARIZATION_WINDOW_OVERLAP", 30))
+if not 0 <= DIARIZATION_WINDOW_OVERLAP < DIARIZATION_WINDOW_SECONDS:
+    raise ValueError(
+        f"DIARIZATION_WINDOW_OVERLAP ({DIARIZATION_WINDOW_OVERLAP}) должно быть неотрицательным "
+        f"и меньше DIARIZATION_WINDOW_SECONDS ({DIARIZATION_WINDOW_SECONDS})"
+    )
+# Косинусное расстояние, до которого локальный спикер окна считается уже известным
+DIARIZATION_LINK_THRESHOLD = float(os.getenv("DIARIZATION_LINK_THRESHOLD", 0.5))
+
+# Пайплайн загружается один раз на процесс и живёт, пока жив процесс.
+# pyannote и torch импортируются только в процессах пула: основному процессу
+# воркера они не нужны, а импорт занимает секунды
+_pipeline = None
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+_in_flight = 0
+
+
+def _get_pipeline():
+    global _pipeline
+    if _pipeline is None:
+        from pyannote.audio import Pipeline
+        _pipeline = Pipeline.from_pretrained(DIARIZATION_MODEL,
+                                             use_auth_token=os.getenv('DIARIZATION_TOKEN'))
+    return _pipeline
+
 
 def diarize(audio_path: str) -> List[Dict]:
+    from pyannote.audio import Audio
     audio = Audio(sample_rate=16000)
-    diarization_token = os.getenv('DIARIZATION_TOKEN')
-    
+
     waveform, sample_rate = audio(audio_path)
-    pipeline = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1", 
-                                        use_auth_token=diarization_token)
-    diarization = pipeline({
+    diarization = _get_pipeline()({
         "waveform": waveform,
         "sample_rate": sample_rate
     })
@@ -18,4 +54,231 @@ def diarize(audio_path: str) -> List[Dict]:
     return [
         {"start": segment.start, "end": segment.end, "speaker": speaker}
         for segment, _, speaker in diarization.itertracks(yield_label=True)
-    ]
\ No newline at end of file
+    ]
+
+
+def _diarize_window(audio_path: str, start: float, end: float) -> Tuple[List[Dict], List[str], np.ndarray]:
+    from pyannote.audio import Audio
+    from pyannote.core import Segment
+    # Читается только кусок файла этого окна
+    audio = Audio(sample_rate=16000)
+    waveform, sample_rate = audio.crop(audio_path, Segment(start, end))
+    diarization, embeddings = _get_pipeline()(
+        {"waveform": waveform, "sample_rate": sample_rate},
+        return_embeddings=True
+    )
+    segments = [
+        {"start": segment.start + start, "end": segment.end + start, "speaker": speaker}
+        for segment, _, speaker in diarization.itertracks(yield_label=True)
+    ]
+    # Строки embeddings идут в порядке diarization.labels()
+    return segments, list(diarization.labels()), np.asarray(embeddings, dtype=np.float32)
+
+
+def plan_windows(duration: float,
+                 window: float = DIARIZATION_WINDOW_SECONDS,
+                 overlap: float = DIARIZATION_WINDOW_OVERLAP) -> List[Tuple[float, float]]:
+    if not 0 <= overlap < window:
+        raise ValueError(f"Перекрытие окон {overlap} должно быть меньше окна {window}")
+    windows = []
+    start = 0.0
+    while True:
+        end = min(start + window, duration)
+        windows.append((start, end))
+        if end >= duration:
+            return windows
+        start = end - overlap
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+def link_window_speakers(window_labels: List[List[str]], window_embeddings: List[np.ndarray],
+                         threshold: float = DIARIZATION_LINK_THRESHOLD) -> List[Dict[str, str]]:
+    # Онлайн-кластеризация: локальные спикеры окна сопоставляются с глобальными
+    # центроидами венгерским алгоритмом. Два спикера одного окна никогда не
+    # сливаются в одного, а всё дальше порога становится новым спикером
+    from scipy.optimize import linear_sum_assignment
+    centroids: List[np.ndarray] = []
+    counts: List[int] = []
+    mappings = []
+    for labels, embeddings in zip(window_labels, window_embeddings):
+        mapping: Dict[str, str] = {}
+        valid = [i for i in range(len(labels)) if np.all(np.isfinite(embeddings[i]))]
+        if centroids and valid:
+            local = _normalize(embeddings[valid])
+            known = _normalize(np.stack(centroids))
+            # Центроиды спикеров без эмбеддинга ни с кем не сопоставляются
+            distances = np.nan_to_num(1 - local @ known.T, nan=2.0)
+            for row, col in zip(*linear_sum_assignment(distances)):
+                if distances[row, col] <= threshold:
+                    i = valid[row]
+                    mapping[labels[i]] = f"SPEAKER_{col:02d}"
+                    centroids[col] = (centroids[col] * counts[col] + embeddings[i]) / (counts[col] + 1)
+                    counts[col] += 1
+        for i, label in enumerate(labels):
+            if label in mapping:
+                continue
+            mapping[label] = f"SPEAKER_{len(centroids):02d}"
+            # Спикер без эмбеддинга получает метку, но в центроиды не попадает
+            centroids.append(embeddings[i] if i in valid else np.full(embeddings.shape[1], np.nan))
+            counts.append(1)
+        mappings.append(mapping)
+    return mappings
+
+
+def stitch_windows(windows: List[Tuple[float, float]], window_segments: List[List[Dict]],
+                   mappings: List[Dict[str, str]]) -> List[Dict]:
+    # Каждое окно отвечает за свой отрезок до середины перекрытия с соседями
+    stitched = []
+    for i, ((start, end), segments, mapping) in enumerate(zip(windows, window_segments, mappings)):
+        own_start = start if i == 0 else (start + windows[i - 1][1]) / 2
+        own_end = end if i == len(windows) - 1 else (end + windows[i + 1][0]) / 2
+        for segment in segments:
+            seg_start, seg_end = max(segment["start"], own_start), min(segment["end"], own_end)
+            if seg_end > seg_start:
+                stitched.append({"start": seg_start, "end": seg_end, "speaker": mapping[segment["speaker"]]})
+
+    stitched.sort(key=lambda x: x["start"])
+    merged = []
+    for segment in stitched:
+        # Реплика, разрезанная границей окон, склеивается обратно
+        if merged and merged[-1]["speaker"] == segment["speaker"] and segment["start"] - merged[-1]["end"] < 1e-3:
+            merged[-1]["end"] = max(merged[-1]["end"], segment["end"])
+        else:
+            merged.append(segment)
+    return merged
+
+
+def _init_worker(torch_threads: int):
+    import torch
+    torch.set_num_threads(torch_threads)
+    _get_pipeline()
+
+
+def _warmup() -> int:
+    import torch
+    # Две секунды тишины: прогоняем граф и ленивую инициализацию моделей
+    _get_pipeline()({"waveform": torch.zeros(1, 32000), "sample_rate": 16000})
+    return os.getpid()
+
+
+def _ping() -> Dict:
+    return {"pid": os.getpid(), "loaded": _pipeline is not None}
+
+
+def start_diarization_pool(pool_size: int = DIARIZATION_POOL_SIZE,
+                           torch_threads: int = DIARIZATION_TORCH_THREADS) -> ProcessPoolExecutor:
+    global _pool, _pool_size
+    if _pool is None:
+        pool_size = max(1, pool_size)
+        torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // pool_size)
+        # spawn, а не fork: torch плохо переносит fork после инициализации потоков
+        _pool = ProcessPoolExecutor(
+            max_workers=pool_size,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(torch_threads,)
+        )
+        _pool_size = pool_size
+    return _pool
+
+
+def stop_diarization_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def restart_diarization_pool(broken: Optional[ProcessPoolExecutor] = None) -> ProcessPoolExecutor:
+    # broken — пул, на котором упала задача. Если его уже заменили (упали сразу
+    # несколько задач), новый здоровый пул не трогаем: иначе отменим поставленную в него работу
+    global _pool
+    if broken is not None and _pool is not broken:
+        return start_diarization_pool(_pool_size or DIARIZATION_POOL_SIZE)
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+    return start_diarization_pool(_pool_size or DIARIZATION_POOL_SIZE)
+
+
+async def warmup_diarization_pool() -> List[int]:
+    # По одной задаче прогрева на процесс: пул поднимет все процессы сразу,
+    # и первая настоящая задача не будет ждать загрузки модели
+    pool = start_diarization_pool()
+    loop = asyncio.get_running_loop()
+    pids = await asyncio.gather(*(loop.run_in_executor(pool, _warmup) for _ in range(_pool_size)))
+    return sorted(set(pids))
+
+
+async def check_diarization_pool(timeout: float = DIARIZATION_HEALTH_TIMEOUT) -> bool:
+    if _pool is None:
+        return False
+    loop = asyncio.get_running_loop()
+    try:
+        info = await asyncio.wait_for(loop.run_in_executor(_pool, _ping), timeout)
+    except (BrokenProcessPool, asyncio.TimeoutError):
+        return False
+    return info["loaded"]
+
+
+def diarization_pool_busy() -> bool:
+    return _in_flight > 0
+
+
+async def diarize_in_pool(audio_path: str) -> List[Dict]:
+    global _in_flight
+    pool = start_diarization_pool()
+    loop = asyncio.get_running_loop()
+    _in_flight += 1
+    try:
+        return await loop.run_in_executor(pool, diarize, audio_path)
+    except BrokenProcessPool:
+        # Процесс умер (например, OOM) — поднимаем пул заново для следующих задач
+        restart_diarization_pool(pool)
+        raise
+    finally:
+        _in_flight -= 1
+
+
+async def diarize_windowed_in_pool(audio_path: str, duration: float,
+                                   on_progress: Optional[Callable[[float], None]] = None) -> List[Dict]:
+    global _in_flight
+    pool = start_diarization_pool()
+    loop = asyncio.get_running_loop()
+    windows = plan_windows(duration)
+    done = 0
+
+    def window_done(future):
+        nonlocal done
+        done += 1
+        if on_progress is not None and not future.cancelled() and future.exception() is None:
+            on_progress(done / len(windows))
+
+    _in_flight += 1
+    try:
+        # Окна независимы и расходятся по процессам пула параллельно
+        futures = [loop.run_in_executor(pool, _diarize_window, audio_path, start, end) for start, end in windows]
+        for future in futures:
+            future.add_done_callback(window_done)
+        results = await asyncio.gather(*futures)
+    except BrokenProcessPool:
+        restart_diarization_pool(pool)
+        raise
+    finally:
+        _in_flight -= 1
+
+    window_segments, window_labels, window_embeddings = zip(*results)
+    mappings = link_window_speakers(list(window_labels), list(window_embeddings))
+    return stitch_windows(windows, list(window_segments), mappings)
+
+
+async def diarize_audio(audio_path: str, duration: Optional[float] = None,
+                        on_progress: Optional[Callable[[float], None]] = None) -> List[Dict]:
+    # Прогресс (доля от 0 до 1) сообщается по готовым окнам; короткая запись — одно окно
+    if duration is None or duration <= DIARIZATION_WINDOW_SECONDS:
+        return await diarize_in_pool(audio_path)
+    return await diarize_windowed_in_pool(audio_path, duration, on_progress)
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+import aiofiles
+import httpx
+
+from utils import get_logger, safe_remove
+
+DOWNLOAD_MAX_SIZE_MB = float(os.getenv("DOWNLOAD_MAX_SIZE_MB", 500))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", 30))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", 3))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", 10))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class FileTooLargeError(Exception):
+    pass
+
+
+@dataclass
+class DownloadResult:
+    path: str
+    size: int
+    sha256: str
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=DOWNLOAD_TIMEOUT,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=DOWNLOAD_MAX_CONNECTIONS,
+                                max_keepalive_connections=DOWNLOAD_MAX_CONNECTIONS)
+        )
+    return _client
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _expected_size(response: httpx.Response) -> Optional[int]:
+    # Для 206 полный размер в Content-Range: "bytes 100-999/1000"
+    content_range = response.headers.get("content-range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = response.headers.get("content-length")
+    return int(content_length) if content_length and content_length.isdigit() else None
+
+
+async def download_file(url: str, dest_path: str, max_size: Optional[int] = None) -> DownloadResult:
+    if max_size is None:
+        max_size = int(DOWNLOAD_MAX_SIZE_MB * 1024 * 1024)
+    client = get_http_client()
+    sha256 = hashlib.sha256()
+    written = 0
+    attempt = 0
+
+    try:
+        async with aiofiles.open(dest_path, "wb") as f:
+            while True:
+                # identity: смещения Range должны совпадать с байтами на диске
+                headers = {"Accept-Encoding": "identity"}
+                if written:
+                    headers["Range"] = f"bytes={written}-"
+                try:
+                    async with client.stream("GET", url, headers=headers) as response:
+                        response.raise_for_status()
+                        if written and response.status_code != 206:
+                            # Сервер проигнорировал Range — качаем с начала
+                            await f.seek(0)
+                            await f.truncate()
+                            sha256 = hashlib.sha256()
+                            written = 0
+
+                        expected = _expected_size(response)
+                        if expected is not None and expected > max_size:
+                            raise FileTooLargeError(f"Файл {expected} байт больше лимита {max_size}")
+
+                        # Хэш считаем по ходу записи, чтобы не перечитывать файл
+                        async for chunk in response.aiter_raw(DOWNLOAD_CHUNK_SIZE):
+                            written += len(chunk)
+                            if written > max_size:
+                                raise FileTooLargeError(f"Файл больше лимита {max_size} байт")
+                            sha256.update(chunk)
+                            await f.write(chunk)
+                    break
+                except httpx.TransportError as e:
+                    attempt += 1
+                    if attempt > DOWNLOAD_RETRIES:
+                        raise
+                    get_logger("downloader").warning(
+                        f"Обрыв загрузки {url} на {written} байтах ({e!r}), попытка {attempt}"
+                    )
+                    await asyncio.sleep(min(2 ** attempt, 10))
+    except BaseException:
+        safe_remove(dest_path)
+        raise
+
+    return DownloadResult(path=dest_path, size=written, sha256=sha256.hexdigest())
@@ -0,0 +1,130 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+import multiprocessing
+import hashlib
+import asyncio
+import json
+import time
+import os
+
+from auth.cache import TTLCache
+from downloader import get_http_client
+from transcript_format import load_transcript
+from utils import get_logger
+
+EXPORT_CACHE_DIR = os.getenv("EXPORT_CACHE_DIR", "export_cache")
+EXPORT_POOL_SIZE = int(os.getenv("EXPORT_POOL_SIZE", 2))
+# Сколько экспортов может ждать или выполняться одновременно — расшифровки держатся в памяти
+EXPORT_MAX_PENDING = int(os.getenv("EXPORT_MAX_PENDING", 8))
+EXPORT_CACHE_RETENTION_HOURS = float(os.getenv("EXPORT_CACHE_RETENTION_HOURS", 168))
+EXPORT_CACHE_PURGE_INTERVAL = float(os.getenv("EXPORT_CACHE_PURGE_INTERVAL", 3600))
+
+MEDIA_TYPES = {
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "pdf": "application/pdf",
+}
+
+logger = get_logger("export")
+_pool: Optional[ProcessPoolExecutor] = None
+_pending: Optional[asyncio.Semaphore] = None
+_in_progress: Dict[str, asyncio.Task] = {}
+# Файл результата по ссылке не меняется — хэш содержимого запоминаем, чтобы
+# повторный экспорт не скачивал расшифровку заново
+transcript_hash_cache = TTLCache("transcript_hash", shared=False)
+
+
+def start_export_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=max(1, EXPORT_POOL_SIZE),
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def stop_export_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def export_key(transcript_hash: str, speaker_names: Optional[Dict[str, str]], file_format: str) -> str:
+    raw = json.dumps([transcript_hash, sorted((speaker_names or {}).items()), file_format])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _render(data: bytes, speaker_names: Optional[Dict[str, str]], file_format: str, path: str):
+    # Выполняется в процессе пула. Пишем во временный файл и переименовываем:
+    # читатели кэша не увидят недописанный документ
+    # python-docx (с lxml) нужен только процессам пула — API его не импортирует
+    from convert import render_dialog
+    base_path = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp"
+    rendered = render_dialog(load_transcript(data), base_path, speaker_names, file_format)
+    os.replace(rendered, path)
+    if file_format == "pdf":
+        os.remove(f"{base_path}.docx")
+
+
+async def _fetch_transcript(result_url: str) -> bytes:
+    response = await get_http_client().get(result_url)
+    response.raise_for_status()
+    return response.content
+
+
+async def _build(result_url: str, data: Optional[bytes], speaker_names: Optional[Dict[str, str]],
+                 file_format: str, path: str) -> str:
+    global _pending
+    if _pending is None:
+        _pending = asyncio.Semaphore(EXPORT_MAX_PENDING)
+    async with _pending:
+        if data is None:
+            data = await _fetch_transcript(result_url)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(start_export_pool(), _render, data, speaker_names, file_format, path)
+    return path
+
+
+async def export_transcript(result_url: str, speaker_names: Optional[Dict[str, str]], file_format: str) -> str:
+    data = None
+    transcript_hash = transcript_hash_cache.get(result_url)
+    if transcript_hash is None:
+        data = await _fetch_transcript(result_url)
+        transcript_hash = hashlib.sha256(data).hexdigest()
+        transcript_hash_cache.set(result_url, transcript_hash)
+
+    key = export_key(transcript_hash, speaker_names, file_format)
+    path = os.path.join(EXPORT_CACHE_DIR, f"{key}.{file_format}")
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    # Одинаковые запросы, пришедшие одновременно, ждут одну и ту же сборку
+    task = _in_progress.get(key)
+    if task is None:
+        os.makedirs(EXPORT_CACHE_DIR, exist_ok=True)
+        task = asyncio.ensure_future(_build(result_url, data, speaker_names, file_format, path))
+        _in_progress[key] = task
+        task.add_done_callback(lambda _: _in_progress.pop(key, None))
+    return await asyncio.shield(task)
+
+
+def purge_export_cache(retention_hours: float = EXPORT_CACHE_RETENTION_HOURS) -> int:
+    if not os.path.isdir(EXPORT_CACHE_DIR):
+        return 0
+    deadline = time.time() - retention_hours * 3600
+    purged = 0
+    for entry in os.scandir(EXPORT_CACHE_DIR):
+        # mtime обновляется при каждой отдаче из кэша — удаляются давно не запрошенные
+        if entry.is_file() and entry.stat().st_mtime < deadline:
+            os.remove(entry.path)
+            purged += 1
+    return purged
+
+
+async def export_cache_janitor():
+    while True:
+        try:
+            await asyncio.to_thread(purge_export_cache)
+        except OSError as e:
+            logger.warning(f"Failed to purge export cache: {e}")
+        await asyncio.sleep(EXPORT_CACHE_PURGE_INTERVAL)
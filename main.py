@@ -1,67 +1,577 @@
 from dotenv import load_dotenv
-from diarization import diarize
-from preprocessor import preprocess_audio
-from transcription import transcription
-from aligner import align_speakers_with_text
-from psdb_client import init_db_client, get_waiting_task, set_task_status, set_task_result_url
-from urllib.request import urlretrieve
-from schema import TaskStatus
-import json
+
+# До импорта остальных модулей: они читают настройки из окружения при импорте
+load_dotenv()
+
+from diarization import (
+    DIARIZATION_POOL_SIZE,
+    diarize_audio,
+    start_diarization_pool,
+    stop_diarization_pool,
+    restart_diarization_pool,
+    warmup_diarization_pool,
+    check_diarization_pool,
+    diarization_pool_busy
+)
+from preprocessor import transcode_audio
+from transcription import transcribe_audio
+from aligner import iter_aligned_segments
+from psdb_client import (
+    init_db_client,
+    claim_task,
+    listen_for_tasks,
+    wait_for_task_notification,
+    set_task_result_url,
+    set_task_manifest_url,
+    save_task_timings,
+    publish_progress,
+    get_cached_result,
+    save_cached_result,
+    purge_result_cache,
+    index_transcript,
+    copy_transcript_index,
+    get_task,
+    resume_tasks,
+    extend_task_leases,
+    release_task,
+    reap_expired_tasks
+)
+from pipeline import start_stage, retrying
+from downloader import download_file, close_http_client
+import checkpoints
+import httpx
+from schema import Task, TaskStatus
+from utils import get_logger, safe_remove, JsonArrayWriter
+from dataclasses import dataclass, field
+from metrics import STAGE_QUEUED_SECONDS, QUEUE_WAIT_SECONDS, RESULT_CACHE, stage_timer, observe_task
+from prometheus_client import start_http_server
+import time
+from typing import Dict, List, Optional, Tuple
+import socket
+import re
+import uuid
+import io
 import os
-from supabase_client import upload_file_to_supabase
+from supabase_client import upload_bytes_to_supabase
+from transcript_format import encode_transcript, CONTENT_TYPE as COMPACT_CONTENT_TYPE
+from partial_results import PARTIAL_RESULTS, PARTIAL_BATCH_SEGMENTS, PartialPublisher
 import asyncio
-import aiofiles.os
 
 PATH_TO_AUDIO_FILES = 'audio_to_process'
-PATH_TO_TRANSCRIPTIONS = 'transcriptions'
+# json — совместимый с текущим фронтендом, compact — колоночный формат transcript_format
+RESULT_FORMAT = os.getenv("RESULT_FORMAT", "json")
+DIARIZATION_HEALTH_INTERVAL = float(os.getenv("DIARIZATION_HEALTH_INTERVAL", 60))
+# Страховочный опрос на случай потерянного NOTIFY
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", 30))
 
-load_dotenv()
-init_db_client()
+# Параллелизм по стадиям конвейера
+DOWNLOAD_CONCURRENCY = int(os.getenv("PIPELINE_DOWNLOAD_CONCURRENCY", 4))
+PREPROCESS_CONCURRENCY = int(os.getenv("PIPELINE_PREPROCESS_CONCURRENCY", 2))
+INFERENCE_CONCURRENCY = int(os.getenv("PIPELINE_INFERENCE_CONCURRENCY", DIARIZATION_POOL_SIZE))
+UPLOAD_CONCURRENCY = int(os.getenv("PIPELINE_UPLOAD_CONCURRENCY", 4))
+# Ёмкость очереди между соседними стадиями
+STAGE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 2))
+# Сколько задач воркер держит захваченными одновременно
+MAX_IN_FLIGHT = int(os.getenv(
+    "PIPELINE_MAX_IN_FLIGHT",
+    DOWNLOAD_CONCURRENCY + PREPROCESS_CONCURRENCY + INFERENCE_CONCURRENCY + UPLOAD_CONCURRENCY
+))
 
-async def main():
+# Меняется вместе с моделями или форматом результата — старые записи кэша перестают совпадать
+PIPELINE_VERSION = f'{os.getenv("PIPELINE_VERSION", "1")}:{RESULT_FORMAT}'
+RESULT_CACHE_RETENTION_DAYS = int(os.getenv("RESULT_CACHE_RETENTION_DAYS", 90))
+RESULT_CACHE_PURGE_INTERVAL = float(os.getenv("RESULT_CACHE_PURGE_INTERVAL", 3600))
+# Повторы стадии при временных сбоях сети, хранилища и API
+STAGE_RETRIES = int(os.getenv("STAGE_RETRIES", 3))
+STAGE_RETRY_MAX_DELAY = float(os.getenv("STAGE_RETRY_MAX_DELAY", 30))
+CHECKPOINT_PURGE_INTERVAL = float(os.getenv("CHECKPOINT_PURGE_INTERVAL", 3600))
+# Аренда задачи: воркер продлевает её пульсом, истёкшие аренды забирают другие воркеры.
+# WORKER_ID должен переживать перезапуск процесса (по умолчанию — имя хоста/контейнера),
+# чтобы после рестарта воркер сразу забрал свои задачи. Несколько воркеров на хосте — разные WORKER_ID
+WORKER_ID = os.getenv("WORKER_ID") or socket.gethostname()
+TASK_LEASE_SECONDS = float(os.getenv("TASK_LEASE_SECONDS", 120))
+TASK_HEARTBEAT_INTERVAL = float(os.getenv("TASK_HEARTBEAT_INTERVAL", 30))
+TASK_REAPER_INTERVAL = float(os.getenv("TASK_REAPER_INTERVAL", 60))
+# После стольких захватов задача, роняющая воркер или стадии, уходит в FAILED
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", 3))
+TRANSIENT_ERRORS = (httpx.TransportError, ConnectionError, TimeoutError, asyncio.TimeoutError)
+# Порт /metrics воркера для Prometheus; 0 — не поднимать
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 9100))
+
+logger = get_logger("worker")
+
+
+class LeaseLostError(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    task: Task
+    audio_path: Optional[str] = None
+    audio_hash: Optional[str] = None
+    audio_duration: Optional[float] = None
+    words: Optional[List[Dict]] = None
+    turns: Optional[List[Dict]] = None
+    cached: bool = False
+    partial: Optional[PartialPublisher] = None
+    # Длительности стадий и шагов, секунды; сохраняются в task.stage_timings
+    timings: Dict[str, float] = field(default_factory=dict)
+    claimed_at: float = field(default_factory=time.perf_counter)
+    stage_done_at: float = field(default_factory=time.perf_counter)
+    # Аренду не удалось продлить — задачу уже обрабатывает другой воркер
+    lease_lost: bool = False
+
+
+# Задачи этого воркера от захвата до завершения; их аренду продлевает lease_heartbeat
+in_flight: Dict[str, Job] = {}
+
+
+async def diarization_watchdog():
+    while True:
+        await asyncio.sleep(DIARIZATION_HEALTH_INTERVAL)
+        # Пока идёт диаризация, процессы заняты и пинг не пройдёт — проверяем только простаивающий пул
+        if diarization_pool_busy():
+            continue
+        if not await check_diarization_pool():
+            logger.warning("Пул диаризации не отвечает, перезапускаем")
+            restart_diarization_pool()
+            await warmup_diarization_pool()
+
+
+def local_audio_path(task: Task) -> str:
+    # Имя файла — по id задачи: одинаковые file_name у задач в конвейере не должны
+    # перезаписывать друг друга, а из file_name берётся только безопасное расширение
+    ext = os.path.splitext(os.path.basename(task.file_name))[1].lower()
+    if not re.fullmatch(r"\.[a-z0-9]{1,5}", ext):
+        ext = ""
+    return os.path.join(PATH_TO_AUDIO_FILES, f"{task.id}{ext}")
+
+
+def resume(job: Job):
+    # Продолжение после падения воркера или повторной постановки задачи:
+    # оплаченные диаризация и транскрибация не повторяются
+    task_id = job.task.id
+    meta = checkpoints.load(task_id, "meta")
+    if not meta:
+        return
+    job.turns = checkpoints.load(task_id, "turns")
+    job.words = checkpoints.load(task_id, "words")
+    audio_path = checkpoints.audio_path(task_id)
+    inferred = job.turns is not None and job.words is not None
+    if meta.get("audio_duration") is not None and (audio_path or inferred):
+        job.audio_hash = meta["audio_hash"]
+        job.audio_duration = meta["audio_duration"]
+        job.audio_path = audio_path
+    done = [name for name, value in (("turns", job.turns), ("words", job.words),
+                                     ("audio", job.audio_duration)) if value is not None]
+    logger.info(f"Задача {task_id}: продолжаем с контрольной точки ({', '.join(done) or 'хэш аудио'})")
+
+
+async def download(job: Job) -> Job:
+    resume(job)
+    if job.audio_duration is None:
+        job.audio_path = local_audio_path(job.task)
+        downloaded = await download_file(job.task.file_url, job.audio_path)
+        job.audio_hash = downloaded.sha256
+        await asyncio.to_thread(checkpoints.save, job.task.id, "meta", {"audio_hash": job.audio_hash})
+
+    cached = get_cached_result(job.audio_hash, PIPELINE_VERSION)
+    if cached is None:
+        RESULT_CACHE.labels("miss").inc()
+        publish_progress(job.task.id, "downloaded")
+        return job
+
+    # Такой файл уже обрабатывали — отдаём готовую ссылку и пропускаем инференс
+    RESULT_CACHE.labels("hit").inc()
+    logger.info(f"Задача {job.task.id}: результат из кэша")
+    set_task_result_url(job.task.id, cached['result_url'])
+    if cached['task_id'] is not None:
+        copy_transcript_index(cached['task_id'], job.task.id, job.task.telegram_id)
+    publish_progress(job.task.id, "uploaded", 1.0, TaskStatus.finished)
+    job.cached = True
+    # Задача уже FINISHED: аренду больше не продлеваем, иначе пульс сочтёт её потерянной
+    in_flight.pop(job.task.id, None)
+    return job
+
+
+async def preprocess(job: Job) -> Job:
+    # audio_duration уже известна — аудио подготовлено до перезапуска
+    if job.cached or job.audio_duration is not None:
+        return job
+    # Один проход ffmpeg: 16 кГц моно для диаризации и для Whisper
+    prepared = await asyncio.to_thread(transcode_audio, job.audio_path)
+    job.audio_path = await asyncio.to_thread(checkpoints.keep_audio, job.task.id, prepared.path)
+    job.audio_duration = prepared.duration
+    await asyncio.to_thread(checkpoints.save, job.task.id, "meta",
+                            {"audio_hash": job.audio_hash, "audio_duration": job.audio_duration})
+    publish_progress(job.task.id, "preprocessed")
+    return job
+
+
+async def infer(job: Job) -> Job:
+    if job.cached:
+        return job
+    task_id = job.task.id
+    chunks_done = 0
+
+    # Каждый результат сохраняется сразу, как готов: при повторе стадии
+    # или после перезапуска пересчитывается только недостающий
+    async def diarized():
+        if job.turns is not None:
+            return
+        with stage_timer("diarize", job.timings):
+            turns = await diarize_audio(job.audio_path, job.audio_duration,
+                                        on_progress=lambda fraction: publish_progress(task_id, "diarizing", fraction))
+        await asyncio.to_thread(checkpoints.save, task_id, "turns", turns)
+        job.turns = turns
+        publish_progress(task_id, "diarized", 1.0)
+
+    async def words_ready(index: int, total: int, start: float, end: float, words: List[Dict]):
+        # Слова куска без спикеров — пользователь видит текст, не дожидаясь всей записи.
+        # Запись из одного куска (обычное голосовое) готова целиком сразу — частей не публикуем
+        nonlocal chunks_done
+        if total < 2:
+            return
+        if PARTIAL_RESULTS:
+            if job.partial is None:
+                job.partial = PartialPublisher(task_id)
+            first = job.partial.manifest_url is None
+            await job.partial.publish("words", index, start, end, words)
+            if first:
+                set_task_manifest_url(task_id, job.partial.manifest_url)
+        chunks_done += 1
+        publish_progress(task_id, "transcribing", chunks_done / total)
+
+    # Слова каждого куска — отдельный чекпоинт: 429 на одном куске не заставляет
+    # платить за уже распознанные. Границы сверяются — план кусков мог поменяться
+    def load_chunk(index: int, start: float, end: float) -> Optional[List[Dict]]:
+        saved = checkpoints.load(task_id, f"chunk-{index:04d}")
+        if saved is None or (saved["start"], saved["end"]) != (start, end):
+            return None
+        return saved["words"]
+
+    def save_chunk(index: int, start: float, end: float, words: List[Dict]):
+        checkpoints.save(task_id, f"chunk-{index:04d}", {"start": start, "end": end, "words": words})
+
+    async def transcribed():
+        if job.words is not None:
+            return
+        with stage_timer("transcribe", job.timings):
+            words = await transcribe_audio(job.audio_path, job.audio_duration, on_chunk=words_ready,
+                                           load_chunk=load_chunk, save_chunk=save_chunk)
+        await asyncio.to_thread(checkpoints.save, task_id, "words", words)
+        job.words = words
+        publish_progress(task_id, "transcribed", 1.0)
+
+    # Ждём обе ветки, даже если одна упала: вторая успеет сохранить свой результат
+    for result in await asyncio.gather(diarized(), transcribed(), return_exceptions=True):
+        if isinstance(result, BaseException):
+            raise result
+    return job
+
+
+def render_result(segments) -> Tuple[bytes, str, str]:
+    if RESULT_FORMAT == "compact":
+        return encode_transcript(segments), "lltr", COMPACT_CONTENT_TYPE
+    # Текст кодируется в UTF-8 по мере записи: в памяти одна копия результата, а не str и bytes
+    buffer = io.BytesIO()
+    text = io.TextIOWrapper(buffer, encoding="utf-8")
+    writer = JsonArrayWriter(text)
+    for segment in segments:
+        writer.write(segment)
+    writer.close()
+    text.flush()
+    text.detach()
+    return buffer.getvalue(), "json", "application/json"
+
+
+async def upload(job: Job) -> Job:
+    if job.cached:
+        return job
+
+    # Реплики сериализуются по мере выравнивания и загружаются прямо из памяти
+    segments = iter_aligned_segments(
+        sorted(job.words, key=lambda x: x["start"]),
+        sorted(job.turns, key=lambda x: x["start"])
+    )
+    index_rows = []
+    loop = asyncio.get_running_loop()
+    published = []
+
+    def publish_batch(rows):
+        # Генератор крутится в потоке рендера — публикация уходит в цикл событий
+        batch = [{"start": start, "end": end, "speaker": speaker, "word": word}
+                 for _, start, end, speaker, word in rows]
+        published.append(asyncio.run_coroutine_threadsafe(
+            job.partial.publish("segments", len(published), rows[0][1], rows[-1][2], batch), loop
+        ))
+
+    def indexed(segments):
+        # Реплики со спикерами публикуются пачками, как только их выдал выравниватель,
+        # — задолго до загрузки полного файла
+        batch_start = 0
+        for idx, segment in enumerate(segments):
+            index_rows.append((idx, segment["start"], segment["end"], segment["speaker"], segment["word"]))
+            if job.partial and len(index_rows) - batch_start >= PARTIAL_BATCH_SEGMENTS:
+                publish_batch(index_rows[batch_start:])
+                batch_start = len(index_rows)
+            yield segment
+        if job.partial and len(index_rows) > batch_start:
+            publish_batch(index_rows[batch_start:])
+
+    with stage_timer("align_render", job.timings):
+        data, extension, content_type = await asyncio.to_thread(render_result, indexed(segments))
+    if published:
+        with stage_timer("publish_segments", job.timings):
+            await asyncio.gather(*(asyncio.wrap_future(future) for future in published))
+
+    with stage_timer("store", job.timings):
+        public_url = await asyncio.to_thread(
+            upload_bytes_to_supabase, data, 'transcriptions',
+            f'transcriptions/{job.task.id}.{extension}', content_type, True
+        )
+        # Манифест частичных результатов указывает на полный файл
+        if job.partial:
+            await job.partial.finish(public_url)
+    set_task_result_url(job.task.id, public_url)
+    # Индекс для поиска по расшифровкам пользователя
+    with stage_timer("index", job.timings):
+        index_transcript(job.task.id, job.task.telegram_id, index_rows)
+    publish_progress(job.task.id, "uploaded", 1.0, TaskStatus.finished)
+    save_cached_result(job.audio_hash, PIPELINE_VERSION, public_url, job.task.id)
+    return job
+
+
+async def result_cache_janitor():
+    while True:
+        # Удаляются только записи кэша: файлы результатов принадлежат своим задачам
+        purged = purge_result_cache(RESULT_CACHE_RETENTION_DAYS)
+        if purged:
+            logger.info(f"Из кэша результатов удалено записей: {purged}")
+        await asyncio.sleep(RESULT_CACHE_PURGE_INTERVAL)
+
+
+async def checkpoint_janitor():
     while True:
+        purged = await asyncio.to_thread(checkpoints.purge)
+        if purged:
+            logger.info(f"Удалено брошенных контрольных точек: {purged}")
+        await asyncio.sleep(CHECKPOINT_PURGE_INTERVAL)
+
+
+def cleanup(job: Job, keep_checkpoints: bool = False):
+    # Удаляем временные файлы. Контрольные точки задачи, вернувшейся в очередь,
+    # остаются до её перезапуска или до очистки по сроку
+    if job.audio_path and job.audio_path != checkpoints.audio_path(job.task.id):
+        safe_remove(job.audio_path)
+    if not keep_checkpoints:
+        checkpoints.remove(job.task.id)
+
+
+def is_transient(error: Optional[BaseException]) -> bool:
+    # Сетевые сбои и ответы 429/5xx (httpx, OpenAI, Supabase) — по всей цепочке причин
+    while error is not None:
+        if isinstance(error, TRANSIENT_ERRORS):
+            return True
+        status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+        if isinstance(status, int) and (status == 429 or status >= 500):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def resumable_tasks() -> List[Task]:
+    # Задачи, которые этот воркер не довёл до конца перед перезапуском:
+    # захватываются по аренде, чтобы не отнять задачу у живого воркера
+    task_ids = []
+    for task_id in checkpoints.list_tasks():
         try:
-            task = get_waiting_task()
-            if task is None:
-                await asyncio.sleep(0.5)
-                continue
-
-            if set_task_status(task.id, TaskStatus.running) == 0:
-                continue
-
-            path_to_audio = os.path.join(PATH_TO_AUDIO_FILES, task.file_name)
-            urlretrieve(task.file_url, path_to_audio)
-            path_to_audio = preprocess_audio(path_to_audio)
-            diarization_task = asyncio.create_task(asyncio.to_thread(diarize, path_to_audio))
-            transcription_task = asyncio.create_task(asyncio.to_thread(transcription, path_to_audio))
-            diarization_result, transcription_result = await asyncio.gather(diarization_task, transcription_task)
-            align_result = align_speakers_with_text(transcription_result, diarization_result)
-
-            base_file_name = task.id
-            transcription_file_path = os.path.join(PATH_TO_TRANSCRIPTIONS, f'{base_file_name}.json')
-            async with aiofiles.open(transcription_file_path, 'w', encoding='utf8') as f:
-                json.dump(align_result, f, ensure_ascii=False)
-
-            # Загружаем результат в Supabase и сохраняем ссылку
-            public_url = upload_file_to_supabase(transcription_file_path, 'transcriptions', f'transcriptions/{base_file_name}.json', 'application/json')
-            set_task_result_url(task.id, public_url)
-            set_task_status(task.id, TaskStatus.finished)
-            
-            # Удаляем временные файлы
+            uuid.UUID(task_id)
+        except ValueError:
+            continue
+        task_ids.append(task_id)
+    if not task_ids:
+        return []
+    tasks = resume_tasks(task_ids, WORKER_ID, TASK_LEASE_SECONDS, TASK_MAX_ATTEMPTS)
+    resumed = {task.id for task in tasks}
+    for task_id in task_ids:
+        if task_id in resumed:
+            continue
+        task = get_task(task_id)
+        if task is None or task.status in (TaskStatus.finished, TaskStatus.failed):
+            checkpoints.remove(task_id)
+    return tasks
+
+
+async def claim_tasks(outbox: asyncio.Queue, slots: asyncio.Semaphore):
+    try:
+        resumed = resumable_tasks()
+    except Exception as e:
+        # Контрольные точки остаются на диске: задачи вернутся через очередь
+        logger.warning(f"Не удалось продолжить незавершённые задачи: {e!r}")
+        resumed = []
+    for task in resumed:
+        await slots.acquire()
+        job = in_flight[task.id] = Job(task)
+        await outbox.put(job)
+    while True:
+        # Не захватываем задачу, пока для неё нет места в конвейере
+        await slots.acquire()
+        task = None
+        while task is None:
             try:
-                await aiofiles.os.remove(path_to_audio)
-                await aiofiles.os.remove(transcription_file_path)
-            except OSError as e:
-                print(f"Ошибка при удалении файлов: {e}")
-        except RuntimeWarning as e:
-            raise RuntimeWarning(f"{str(e)}")
+                task = claim_task(WORKER_ID, TASK_LEASE_SECONDS)
+                if task is None:
+                    await wait_for_task_notification(TASK_POLL_INTERVAL)
+            except Exception as e:
+                # Сбой базы не останавливает воркер: соединение переподключится при следующем запросе
+                logger.warning(f"Не удалось взять задачу: {e!r}")
+                await asyncio.sleep(TASK_POLL_INTERVAL)
+        job = in_flight[task.id] = Job(task)
+        if task.queue_wait is not None:
+            QUEUE_WAIT_SECONDS.observe(task.queue_wait)
+            job.timings["queue_wait"] = round(task.queue_wait, 3)
+        await outbox.put(job)
+
+
+async def lease_heartbeat():
+    renewed_at = time.perf_counter()
+    while True:
+        await asyncio.sleep(TASK_HEARTBEAT_INTERVAL)
+        task_ids = list(in_flight)
+        attempted_at = time.perf_counter()
+        try:
+            owned = set(extend_task_leases(task_ids, WORKER_ID, TASK_LEASE_SECONDS))
+        except Exception as e:
+            logger.warning(f"Не удалось продлить аренду задач: {e!r}")
+            # Аренда, не продлённая дольше своего срока, истекла: задачу могли вернуть
+            # в очередь и отдать другому воркеру. Задача, взятая после последнего
+            # продления, отсчитывает срок от момента захвата
+            for job in list(in_flight.values()):
+                if not job.lease_lost and attempted_at - max(renewed_at, job.claimed_at) >= TASK_LEASE_SECONDS:
+                    logger.warning(f"Задача {job.task.id}: аренда не продлевалась {TASK_LEASE_SECONDS:.0f} с, считаем её потерянной")
+                    job.lease_lost = True
+            continue
+        renewed_at = attempted_at
+        for task_id in task_ids:
+            job = in_flight.get(task_id)
+            if task_id not in owned and job is not None and not job.lease_lost:
+                logger.warning(f"Задача {task_id}: аренда потеряна, задачу забрал другой воркер")
+                job.lease_lost = True
+
+
+async def task_reaper():
+    while True:
+        try:
+            for row in reap_expired_tasks(TASK_MAX_ATTEMPTS):
+                logger.warning(f"Задача {row['id']}: аренда истекла, новый статус {row['status']}")
+        except Exception as e:
+            logger.warning(f"Не удалось вернуть задачи с истёкшей арендой: {e!r}")
+        await asyncio.sleep(TASK_REAPER_INTERVAL)
+
+
+def on_retry(job: Job, error: BaseException, attempt: int, delay: float):
+    logger.warning(f"Задача {job.task.id}: временный сбой {error!r}, попытка {attempt} через {delay} с")
+
+
+def instrumented(name: str, handler):
+    # Время стадии и ожидания перед ней — в гистограммы и в job.timings.
+    # Временные сбои повторяются внутри стадии
+    handler = retrying(handler, STAGE_RETRIES, STAGE_RETRY_MAX_DELAY, is_transient, on_retry)
+
+    async def run(job: Job) -> Job:
+        # Результат из кэша уже записан — стадии его только пропускают
+        if job.cached:
+            return job
+        # Задачу с потерянной арендой доделает её новый владелец
+        if job.lease_lost:
+            raise LeaseLostError(f"аренда задачи {job.task.id} потеряна")
+        queued = time.perf_counter() - job.stage_done_at
+        STAGE_QUEUED_SECONDS.labels(name).observe(queued)
+        job.timings[f"{name}_queued"] = round(queued, 3)
+        with stage_timer(name, job.timings):
+            result = await handler(job)
+        job.stage_done_at = time.perf_counter()
+        return result
+    return run
+
+
+def record_task(job: Job, outcome: str):
+    processing = time.perf_counter() - job.claimed_at
+    job.timings["total"] = round(processing, 3)
+    observe_task(outcome, processing, job.audio_duration)
+    try:
+        save_task_timings(job.task.id, job.timings, finished=outcome in ("finished", "cached"))
+    except Exception as e:
+        logger.warning(f"Задача {job.task.id}: не удалось сохранить тайминги: {e!r}")
+
+
+async def main():
+    init_db_client()
+    listen_for_tasks()
+    if WORKER_METRICS_PORT:
+        start_http_server(WORKER_METRICS_PORT)
+    start_diarization_pool()
+    await warmup_diarization_pool()
+
+    slots = asyncio.Semaphore(MAX_IN_FLIGHT)
+
+    def on_error(stage: str, job: Job, error: BaseException):
+        logger.error(f"Задача {job.task.id} упала на стадии {stage}: {error!r}")
+        in_flight.pop(job.task.id, None)
+        status = None
+        if not job.lease_lost:
+            # Задача возвращается в очередь, после TASK_MAX_ATTEMPTS попыток — FAILED
+            try:
+                status = release_task(job.task.id, WORKER_ID, f"{stage}: {error!r}", TASK_MAX_ATTEMPTS)
+            except Exception as e:
+                logger.warning(f"Задача {job.task.id}: не удалось освободить, вернётся по истечении аренды: {e!r}")
+        cleanup(job, keep_checkpoints=status != TaskStatus.failed)
+        slots.release()
+        record_task(job, "lost" if job.lease_lost else "failed")
+
+    async def finish(job: Job) -> Job:
+        in_flight.pop(job.task.id, None)
+        cleanup(job)
+        slots.release()
+        record_task(job, "cached" if job.cached else "finished")
+        return job
+
+    to_download, to_preprocess, to_infer, to_upload, done = (
+        asyncio.Queue(maxsize=STAGE_QUEUE_SIZE) for _ in range(5)
+    )
+    workers = [
+        asyncio.create_task(diarization_watchdog()),
+        asyncio.create_task(result_cache_janitor()),
+        asyncio.create_task(checkpoint_janitor()),
+        asyncio.create_task(lease_heartbeat()),
+        asyncio.create_task(task_reaper()),
+        asyncio.create_task(claim_tasks(to_download, slots)),
+        *start_stage("download", instrumented("download", download), DOWNLOAD_CONCURRENCY,
+                     to_download, to_preprocess, on_error),
+        *start_stage("preprocess", instrumented("preprocess", preprocess), PREPROCESS_CONCURRENCY,
+                     to_preprocess, to_infer, on_error),
+        *start_stage("infer", instrumented("infer", infer), INFERENCE_CONCURRENCY, to_infer, to_upload, on_error),
+        *start_stage("upload", instrumented("upload", upload), UPLOAD_CONCURRENCY, to_upload, done, on_error),
+        *start_stage("finish", finish, 1, done, None, on_error),
+    ]
+    try:
+        # Воркеры стадий работают бесконечно; gather вернётся только с ошибкой
+        await asyncio.gather(*workers)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await close_http_client()
+
 
 if __name__ == '__main__':
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
-        print("Воркер остановлен")
+        logger.info("Воркер остановлен")
     except Exception as e:
-        print(f"Критическая ошибка: {e}")
+        logger.exception(f"Критическая ошибка: {e}")
     finally:
-        print("Очистка ресурсов завершена")
\ No newline at end of file
+        stop_diarization_pool()
+        logger.info("Очистка ресурсов завершена")
@@ -0,0 +1,75 @@
+from contextlib import contextmanager
+from typing import Dict, Optional
+import time
+
+from prometheus_client import Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Стадии длятся от миллисекунд (загрузка из кэша) до десятков минут (диаризация часового звонка)
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+# Длительность записи делится на корзины, чтобы сравнивать время обработки внутри похожих записей
+DURATION_CLASSES = ((60, "<1m"), (300, "1-5m"), (900, "5-15m"), (3600, "15-60m"))
+
+STAGE_SECONDS = Histogram(
+    "worker_stage_seconds", "Время стадии или шага конвейера", ["stage"], buckets=STAGE_BUCKETS
+)
+STAGE_QUEUED_SECONDS = Histogram(
+    "worker_stage_queued_seconds", "Ожидание задачи в очереди перед стадией", ["stage"], buckets=STAGE_BUCKETS
+)
+STAGE_ERRORS = Counter("worker_stage_errors_total", "Ошибки по стадиям", ["stage"])
+TASKS = Counter("worker_tasks_total", "Завершённые задачи", ["outcome"])
+RESULT_CACHE = Counter("worker_result_cache_total", "Обращения к кэшу результатов", ["result"])
+QUEUE_WAIT_SECONDS = Histogram(
+    "worker_queue_wait_seconds", "От создания задачи до захвата воркером", buckets=STAGE_BUCKETS
+)
+AUDIO_DURATION_SECONDS = Histogram(
+    "worker_audio_duration_seconds", "Длительность обработанных записей",
+    buckets=(30, 60, 300, 600, 900, 1800, 3600, 7200, 14400)
+)
+PROCESSING_SECONDS = Histogram(
+    "worker_processing_seconds", "От захвата до готового результата по классам длительности записи",
+    ["duration_class"], buckets=STAGE_BUCKETS
+)
+REALTIME_FACTOR = Histogram(
+    "worker_realtime_factor", "Время обработки на секунду аудио",
+    buckets=(0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 1.5, 2, 5)
+)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "api_request_seconds", "Латентность запросов API", ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+
+def duration_class(duration: float) -> str:
+    for limit, label in DURATION_CLASSES:
+        if duration < limit:
+            return label
+    return ">60m"
+
+
+@contextmanager
+def stage_timer(stage: str, timings: Optional[Dict[str, float]] = None):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        if timings is not None:
+            timings[stage] = round(elapsed, 3)
+
+
+def observe_task(outcome: str, processing: float, audio_duration: Optional[float] = None):
+    TASKS.labels(outcome).inc()
+    # Упавшие, потерянные и взятые из кэша задачи исказили бы время обработки и RTF
+    if outcome == "finished" and audio_duration:
+        AUDIO_DURATION_SECONDS.observe(audio_duration)
+        PROCESSING_SECONDS.labels(duration_class(audio_duration)).observe(processing)
+        REALTIME_FACTOR.observe(processing / audio_duration)
+
+
+def render_metrics():
+    return generate_latest(), CONTENT_TYPE_LATEST
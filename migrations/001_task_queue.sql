@@ -0,0 +1,6 @@
+-- Порядок FIFO для claim_task и частичный индекс по ожидающим задачам
+ALTER TABLE task ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS task_waiting_created_at_idx
+    ON task (created_at)
+    WHERE status = 'WAIT';
@@ -0,0 +1,12 @@
+-- Кэш результатов по содержимому аудио: одинаковый файл не обрабатывается дважды
+CREATE TABLE IF NOT EXISTS result_cache (
+    audio_hash text NOT NULL,
+    pipeline_version text NOT NULL,
+    result_url text NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    last_hit_at timestamptz NOT NULL DEFAULT now(),
+    hit_count integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (audio_hash, pipeline_version)
+);
+
+CREATE INDEX IF NOT EXISTS result_cache_last_hit_at_idx ON result_cache (last_hit_at);
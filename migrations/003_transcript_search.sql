@@ -0,0 +1,16 @@
+-- Полнотекстовый поиск по репликам расшифровок пользователя.
+-- ё приводится к е и в индексе, и в запросе (см. psdb_client.search_segments)
+CREATE TABLE IF NOT EXISTS transcript_segment (
+    task_id uuid NOT NULL REFERENCES task(id) ON DELETE CASCADE,
+    segment_idx integer NOT NULL,
+    telegram_id bigint NOT NULL,
+    start_time real NOT NULL,
+    end_time real NOT NULL,
+    speaker text,
+    text text NOT NULL,
+    tsv tsvector GENERATED ALWAYS AS (to_tsvector('russian', replace(lower(text), 'ё', 'е'))) STORED,
+    PRIMARY KEY (task_id, segment_idx)
+);
+
+CREATE INDEX IF NOT EXISTS transcript_segment_tsv_idx ON transcript_segment USING gin (tsv);
+CREATE INDEX IF NOT EXISTS transcript_segment_telegram_id_idx ON transcript_segment (telegram_id);
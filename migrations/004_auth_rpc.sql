@@ -0,0 +1,113 @@
+-- Потоки авторизации одной транзакцией на стороне базы (вызываются через supabase rpc).
+-- Таблицы токенов: one_time_tokens и refresh_tokens, пользователи — users
+
+CREATE OR REPLACE FUNCTION issue_one_time_token(p_token_hash text, p_telegram_id bigint, p_ttl_seconds integer)
+RETURNS void
+LANGUAGE sql
+AS $$
+    DELETE FROM one_time_tokens WHERE telegram_id = p_telegram_id;
+    INSERT INTO one_time_tokens(token_hash, telegram_id, expires_at)
+    VALUES (p_token_hash, p_telegram_id, now() + make_interval(secs => p_ttl_seconds));
+$$;
+
+
+-- Погашение одноразового токена: удаление, проверка срока и get-or-create пользователя.
+-- DELETE ... RETURNING не даёт использовать один токен дважды параллельными запросами
+CREATE OR REPLACE FUNCTION exchange_one_time_token(p_token_hash text)
+RETURNS json
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    token one_time_tokens%ROWTYPE;
+    usr users%ROWTYPE;
+BEGIN
+    DELETE FROM one_time_tokens WHERE token_hash = p_token_hash RETURNING * INTO token;
+    IF NOT FOUND THEN
+        RETURN json_build_object('status', 'invalid');
+    END IF;
+    IF token.expires_at IS NOT NULL AND token.expires_at < now() THEN
+        RETURN json_build_object('status', 'expired');
+    END IF;
+
+    SELECT * INTO usr FROM users WHERE telegram_id = token.telegram_id LIMIT 1;
+    IF NOT FOUND THEN
+        INSERT INTO users(telegram_id, email)
+        VALUES (token.telegram_id, token.telegram_id || '@tg.laterlistener.com')
+        RETURNING * INTO usr;
+    END IF;
+    RETURN json_build_object('status', 'ok', 'user', row_to_json(usr));
+END;
+$$;
+
+
+-- Новый refresh-токен пользователя заменяет все его прежние
+CREATE OR REPLACE FUNCTION store_refresh_token(p_token_hash text, p_user_id uuid, p_ttl_seconds integer)
+RETURNS void
+LANGUAGE sql
+AS $$
+    DELETE FROM refresh_tokens WHERE user_id = p_user_id;
+    INSERT INTO refresh_tokens(token_hash, user_id, expires_at)
+    VALUES (p_token_hash, p_user_id, now() + make_interval(secs => p_ttl_seconds));
+$$;
+
+
+-- Ротация: проверка старого токена, отзыв и выпуск нового в одной транзакции
+CREATE OR REPLACE FUNCTION rotate_refresh_token(p_old_hash text, p_new_hash text, p_user_id uuid, p_ttl_seconds integer)
+RETURNS text
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    token refresh_tokens%ROWTYPE;
+BEGIN
+    SELECT * INTO token FROM refresh_tokens WHERE token_hash = p_old_hash FOR UPDATE;
+    IF NOT FOUND OR token.revoked_at IS NOT NULL OR token.user_id IS DISTINCT FROM p_user_id THEN
+        RETURN 'invalid';
+    END IF;
+    IF token.expires_at IS NOT NULL AND token.expires_at < now() THEN
+        UPDATE refresh_tokens SET revoked_at = now() WHERE token_hash = p_old_hash;
+        RETURN 'expired';
+    END IF;
+
+    DELETE FROM refresh_tokens WHERE user_id = p_user_id;
+    INSERT INTO refresh_tokens(token_hash, user_id, expires_at)
+    VALUES (p_new_hash, p_user_id, now() + make_interval(secs => p_ttl_seconds));
+    RETURN 'ok';
+END;
+$$;
+
+
+-- Фоновая чистка просроченных токенов (раньше выполнялась на каждом запросе)
+CREATE OR REPLACE FUNCTION purge_expired_tokens()
+RETURNS json
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    one_time_count integer;
+    refresh_count integer;
+BEGIN
+    DELETE FROM one_time_tokens WHERE expires_at < now();
+    GET DIAGNOSTICS one_time_count = ROW_COUNT;
+    DELETE FROM refresh_tokens WHERE expires_at < now();
+    GET DIAGNOSTICS refresh_count = ROW_COUNT;
+    RETURN json_build_object('one_time_tokens', one_time_count, 'refresh_tokens', refresh_count);
+END;
+$$;
+
+
+-- Функции выпускают и гасят токены от имени любого пользователя: PostgREST открывает
+-- их всем ролям по умолчанию, поэтому вызывать их может только сервер с ключом service_role
+REVOKE EXECUTE ON FUNCTION
+    issue_one_time_token(text, bigint, integer),
+    exchange_one_time_token(text),
+    store_refresh_token(text, uuid, integer),
+    rotate_refresh_token(text, text, uuid, integer),
+    purge_expired_tokens()
+FROM PUBLIC, anon, authenticated;
+
+GRANT EXECUTE ON FUNCTION
+    issue_one_time_token(text, bigint, integer),
+    exchange_one_time_token(text),
+    store_refresh_token(text, uuid, integer),
+    rotate_refresh_token(text, text, uuid, integer),
+    purge_expired_tokens()
+TO service_role;
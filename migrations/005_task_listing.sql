@@ -0,0 +1,3 @@
+-- Keyset-пагинация списка расшифровок пользователя: (telegram_id, created_at, id)
+CREATE INDEX IF NOT EXISTS task_user_created_at_idx
+    ON task (telegram_id, created_at DESC, id DESC);
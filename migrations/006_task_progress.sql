@@ -0,0 +1,3 @@
+-- Последняя стадия и прогресс задачи: снимок для клиентов, подписавшихся на события позже
+ALTER TABLE task ADD COLUMN IF NOT EXISTS stage text;
+ALTER TABLE task ADD COLUMN IF NOT EXISTS progress real;
@@ -0,0 +1,2 @@
+-- Манифест частичных результатов: слова и реплики публикуются частями до готовности полного файла
+ALTER TABLE task ADD COLUMN IF NOT EXISTS manifest_url text;
@@ -0,0 +1,4 @@
+-- Время захвата и завершения задачи и длительности стадий конвейера
+ALTER TABLE task ADD COLUMN IF NOT EXISTS claimed_at timestamptz;
+ALTER TABLE task ADD COLUMN IF NOT EXISTS finished_at timestamptz;
+ALTER TABLE task ADD COLUMN IF NOT EXISTS stage_timings jsonb;
@@ -0,0 +1,14 @@
+-- Владение задачей по аренде: воркер продлевает lease_expires_at, задачи с истёкшей
+-- арендой возвращаются в очередь, после TASK_MAX_ATTEMPTS попыток — FAILED
+ALTER TABLE task ADD COLUMN IF NOT EXISTS worker_id text;
+ALTER TABLE task ADD COLUMN IF NOT EXISTS lease_expires_at timestamptz;
+ALTER TABLE task ADD COLUMN IF NOT EXISTS attempts integer NOT NULL DEFAULT 0;
+ALTER TABLE task ADD COLUMN IF NOT EXISTS error text;
+
+-- Задачи, зависшие в RUNNING до появления аренды, вернутся в очередь через час
+UPDATE task SET lease_expires_at = now() + interval '1 hour'
+    WHERE status = 'RUNNING' AND lease_expires_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS task_running_lease_idx
+    ON task (lease_expires_at)
+    WHERE status = 'RUNNING';
@@ -0,0 +1,7 @@
+-- Задача, породившая результат: попадание в кэш копирует её поисковый индекс
+-- по первичному ключу transcript_segment, а не ищет задачу по task.result_url
+ALTER TABLE result_cache ADD COLUMN IF NOT EXISTS task_id uuid REFERENCES task(id) ON DELETE SET NULL;
+
+UPDATE result_cache c SET task_id = (
+    SELECT t.id FROM task t WHERE t.result_url = c.result_url ORDER BY t.created_at LIMIT 1
+) WHERE c.task_id IS NULL;
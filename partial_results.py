@@ -0,0 +1,58 @@
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+
+from supabase_client import upload_bytes_to_supabase
+
+PARTIAL_RESULTS = os.getenv("PARTIAL_RESULTS", "1") == "1"
+# Сколько выровненных реплик уходит в одну часть
+PARTIAL_BATCH_SEGMENTS = int(os.getenv("PARTIAL_BATCH_SEGMENTS", 500))
+RESULTS_BUCKET = 'transcriptions'
+
+
+class PartialPublisher:
+    # Части результата — неизменяемые файлы transcriptions/<task_id>/<kind>-NNNN.json,
+    # манифест со списком частей перезаписывается после каждой новой части.
+    # Сначала приходят слова без спикеров (по кускам транскрибации), затем реплики
+    # со спикерами пачками по времени по мере выравнивания, в конце — ссылка на полный результат
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        # По (kind, index): повтор стадии перезаливает часть, а не дублирует её в манифесте
+        self.parts: Dict[Tuple[str, int], Dict] = {}
+        self.manifest_url: Optional[str] = None
+        self._lock = asyncio.Lock()
+
+    def _path(self, name: str) -> str:
+        return f'transcriptions/{self.task_id}/{name}'
+
+    async def _upload(self, data: bytes, name: str, cache_control: Optional[str] = None) -> str:
+        # upsert: при повторной обработке задачи части перезаписываются теми же именами
+        return await asyncio.to_thread(
+            upload_bytes_to_supabase, data, RESULTS_BUCKET, self._path(name),
+            'application/json', True, cache_control
+        )
+
+    async def _write_manifest(self, status: str, result_url: Optional[str] = None) -> str:
+        manifest = {
+            "task_id": self.task_id,
+            "status": status,
+            "parts": sorted(self.parts.values(), key=lambda part: (part["kind"] != "words", part["start"])),
+            "result_url": result_url,
+        }
+        data = json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+        # Манифест меняется — CDN не должен отдавать старую версию
+        self.manifest_url = await self._upload(data, 'manifest.json', cache_control='0')
+        return self.manifest_url
+
+    async def publish(self, kind: str, index: int, start: float, end: float, items: List[Dict]) -> str:
+        data = json.dumps(items, ensure_ascii=False).encode("utf-8")
+        url = await self._upload(data, f'{kind}-{index:04d}.json')
+        async with self._lock:
+            self.parts[(kind, index)] = {"kind": kind, "index": index, "start": start, "end": end,
+                                         "count": len(items), "url": url}
+            return await self._write_manifest("partial")
+
+    async def finish(self, result_url: str) -> str:
+        async with self._lock:
+            return await self._write_manifest("final", result_url)
@@ -0,0 +1,56 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+Handler = Callable[[Any], Awaitable[Any]]
+ErrorHandler = Callable[[str, Any, BaseException], None]
+
+
+def start_stage(name: str,
+                handler: Handler,
+                concurrency: int,
+                inbox: asyncio.Queue,
+                outbox: Optional[asyncio.Queue],
+                on_error: ErrorHandler) -> List[asyncio.Task]:
+    # Стадия — N воркеров, читающих из общей очереди. Очереди между стадиями
+    # ограничены, поэтому put в заполненную очередь тормозит стадию (backpressure)
+    async def worker():
+        while True:
+            job = await inbox.get()
+            try:
+                result = await handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                on_error(name, job, e)
+            else:
+                if outbox is not None:
+                    await outbox.put(result)
+            finally:
+                inbox.task_done()
+
+    return [asyncio.create_task(worker(), name=f"{name}-{i}") for i in range(max(1, concurrency))]
+
+
+def retrying(handler: Handler,
+             retries: int,
+             max_delay: float,
+             is_transient: Callable[[BaseException], bool],
+             on_retry: Optional[Callable[[Any, BaseException, int, float], None]] = None) -> Handler:
+    # Повтор стадии при временном сбое с экспоненциальной задержкой, ограниченной max_delay.
+    # Стадия должна быть идемпотентной: уже сделанное она берёт из контрольных точек
+    async def run(job):
+        attempt = 0
+        while True:
+            try:
+                return await handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt >= retries or not is_transient(e):
+                    raise
+                attempt += 1
+                delay = min(2 ** attempt, max_delay)
+                if on_retry is not None:
+                    on_retry(job, e, attempt, delay)
+                await asyncio.sleep(delay)
+    return run
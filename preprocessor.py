@@ -1,10 +1,78 @@
-from pydub import AudioSegment
+from dataclasses import dataclass
+import subprocess
+import tempfile
+import wave
 import os
 
-def preprocess_audio(pfile):
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+TARGET_SAMPLE_RATE = 16000
+TARGET_CHANNELS = 1
+SAMPLE_WIDTH = 2  # s16le
+READ_CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class PreparedAudio:
+    path: str
+    sample_rate: int
+    num_samples: int
+
+    @property
+    def duration(self) -> float:
+        return self.num_samples / self.sample_rate
+
+
+def _read_target_wav(pfile: str):
+    # Уже 16 кГц моно s16 — перекодировать нечего, длительность берём из заголовка
+    try:
+        with wave.open(pfile, "rb") as wf:
+            if (wf.getframerate(), wf.getnchannels(), wf.getsampwidth()) == \
+                    (TARGET_SAMPLE_RATE, TARGET_CHANNELS, SAMPLE_WIDTH):
+                return PreparedAudio(pfile, TARGET_SAMPLE_RATE, wf.getnframes())
+    except (wave.Error, EOFError):
+        pass
+    return None
+
+
+def transcode_audio(pfile: str) -> PreparedAudio:
     filename, ext = os.path.splitext(pfile)
-    ofile = pfile if ext == '.wav' else f"{filename}.wav"
-    if ext != ".wav":
-        AudioSegment.from_file(pfile).export(ofile, format="wav")
-        os.remove(pfile)
-    return ofile
+    if ext == ".wav":
+        prepared = _read_target_wav(pfile)
+        if prepared is not None:
+            return prepared
+
+    ofile = f"{filename}.16k.wav"
+    command = [
+        FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-i", pfile, "-vn",
+        "-ac", str(TARGET_CHANNELS), "-ar", str(TARGET_SAMPLE_RATE),
+        "-f", "s16le", "-acodec", "pcm_s16le", "-"
+    ]
+    # ffmpeg отдаёт сырой PCM в pipe, мы дописываем его в WAV кусками:
+    # память не зависит от длины записи, а число сэмплов считаем по ходу
+    total_bytes = 0
+    with tempfile.TemporaryFile() as stderr, wave.open(ofile, "wb") as wf:
+        wf.setnchannels(TARGET_CHANNELS)
+        wf.setsampwidth(SAMPLE_WIDTH)
+        wf.setframerate(TARGET_SAMPLE_RATE)
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            for chunk in iter(lambda: process.stdout.read(READ_CHUNK_SIZE), b""):
+                wf.writeframesraw(chunk)
+                total_bytes += len(chunk)
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+        stderr.seek(0)
+        error_output = stderr.read()[-2000:].decode("utf-8", errors="replace")
+
+    if returncode != 0:
+        os.remove(ofile)
+        raise RuntimeError(f"ffmpeg не смог перекодировать {pfile}: {error_output.strip()}")
+
+    os.remove(pfile)
+    return PreparedAudio(ofile, TARGET_SAMPLE_RATE, total_bytes // (SAMPLE_WIDTH * TARGET_CHANNELS))
+
+
+def preprocess_audio(pfile):
+    return transcode_audio(pfile).path
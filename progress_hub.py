@@ -0,0 +1,57 @@
+from typing import Dict, Optional, Set
+import asyncio
+import json
+import os
+
+from psdb_client import TASK_PROGRESS_CHANNEL, listen_async
+from utils import get_logger
+
+# События копятся в очереди каждого подписчика; медленный клиент теряет
+# самые старые события, но не тормозит остальных
+PROGRESS_QUEUE_SIZE = int(os.getenv("PROGRESS_QUEUE_SIZE", 100))
+logger = get_logger("progress")
+
+_task_subscribers: Dict[str, Set[asyncio.Queue]] = {}
+_user_subscribers: Dict[int, Set[asyncio.Queue]] = {}
+
+
+def subscribe(task_id: Optional[str] = None, telegram_id: Optional[int] = None) -> asyncio.Queue:
+    queue = asyncio.Queue(maxsize=PROGRESS_QUEUE_SIZE)
+    if task_id is not None:
+        _task_subscribers.setdefault(task_id, set()).add(queue)
+    if telegram_id is not None:
+        _user_subscribers.setdefault(telegram_id, set()).add(queue)
+    return queue
+
+
+def unsubscribe(queue: asyncio.Queue, task_id: Optional[str] = None, telegram_id: Optional[int] = None):
+    for subscribers, key in ((_task_subscribers, task_id), (_user_subscribers, telegram_id)):
+        if key is None or key not in subscribers:
+            continue
+        subscribers[key].discard(queue)
+        if not subscribers[key]:
+            del subscribers[key]
+
+
+def subscriber_count() -> int:
+    return sum(len(s) for s in _task_subscribers.values()) + sum(len(s) for s in _user_subscribers.values())
+
+
+def _dispatch(payload: str):
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        logger.warning(f"Bad progress payload: {payload!r}")
+        return
+    queues = _task_subscribers.get(str(event.get("task_id")), set()) | \
+        _user_subscribers.get(event.get("telegram_id"), set())
+    for queue in queues:
+        if queue.full():
+            # Последнее событие (например, FINISHED) важнее старых
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+
+async def run_progress_listener():
+    # Один LISTEN на процесс API, раздача по подписчикам — в памяти
+    await listen_async(TASK_PROGRESS_CHANNEL, _dispatch)
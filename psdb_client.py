@@ -1,61 +1,233 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
+import asyncpg
 from schema import *
+from typing import List, Optional
+from contextlib import contextmanager
+from datetime import datetime
+import asyncio
+import base64
+import json
+import uuid
 import os
 
+from utils import get_logger
+
 TASKS_TABLE = 'task'
+TASK_CREATED_CHANNEL = 'task_created'
+# События прогресса задачи для API: JSON с task_id, telegram_id, status, stage, progress
+TASK_PROGRESS_CHANNEL = 'task_progress'
+# Колонки для списка на дашборде; полная запись — в get_task
+TASK_LIST_COLUMNS = 'id, file_name, status, result_url, created_at'
+# Событие прогресса собирается из строки задачи, возвращённой UPDATE ... RETURNING
+PROGRESS_EVENT_JSON = (
+    'json_build_object(\'task_id\', id, \'telegram_id\', telegram_id, \'status\', status,'
+    ' \'stage\', stage, \'progress\', progress, \'manifest_url\', manifest_url, \'error\', error)::text'
+)
+PROGRESS_EVENT_COLUMNS = 'id, telegram_id, status, stage, progress, manifest_url, error'
 connection = None
+listen_connection = None
+logger = get_logger("db")
+
+# Асинхронный пул для API; воркер работает через синхронное connection выше
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 20))
+# asyncpg готовит и кэширует запросы на каждом соединении. За pgbouncer в режиме
+# transaction (пулер Supabase) подготовленные запросы не работают — там ставим 0
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 100))
+DB_HEALTH_INTERVAL = float(os.getenv("DB_HEALTH_INTERVAL", 15))
+DB_HEALTH_TIMEOUT = float(os.getenv("DB_HEALTH_TIMEOUT", 5))
+pool: Optional[asyncpg.Pool] = None
+
+
+def _connect():
+    return psycopg2.connect(
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        dbname=os.getenv("DB_DBNAME"),
+        cursor_factory=RealDictCursor
+    )
 
 
 def init_db_client():
     global connection
     try:
-        connection = psycopg2.connect(
-            user=os.getenv("DB_USER"),
-            password=os.getenv("DB_PASSWORD"),
-            host=os.getenv("DB_HOST"),
-            port=os.getenv("DB_PORT"),
-            dbname=os.getenv("DB_DBNAME"),
-            cursor_factory=RealDictCursor
-        )
-
-        cursor = connection.cursor()
+        connection = _connect()
     except Exception as e:
-        print(f"Failed to connect: {e}")
+        logger.error(f"Failed to connect: {e}")
 
 
-def add_task(query: TranscribeQuery):
-    with connection.cursor() as cursor:
-        cursor.execute(f'INSERT INTO task(id, file_url, file_name, status, telegram_id) VALUES (uuid_generate_v4(), \'{query.file_url}\', \'{query.file_name}\', \'WAIT\', \'{query.telegram_id}\') RETURNING id;')
+@contextmanager
+def _transaction():
+    # Воркер работает через одно соединение: после ошибки транзакцию откатываем, иначе
+    # все следующие запросы получат "current transaction is aborted". Разорванное
+    # соединение закрываем и открываем заново при следующем запросе
+    global connection
+    if connection is None or connection.closed:
+        if connection is not None:
+            logger.warning("Reconnecting to the database")
+        connection = _connect()
+    try:
+        with connection.cursor() as cursor:
+            yield cursor
         connection.commit()
-        return cursor.fetchone()
+    except Exception:
+        try:
+            connection.rollback()
+        except psycopg2.Error:
+            connection.close()
+        raise
 
 
-def get_task_status(task_id: str):
-    with connection.cursor() as cursor:
-        cursor.execute(f'SELECT status FROM task WHERE id = \'{task_id}\';')
-        return cursor.fetchone()
+def claim_task(worker_id: str, lease_seconds: float):
+    # Выбор и захват одним запросом: SKIP LOCKED не даёт двум воркерам взять одну строку.
+    # Задача принадлежит воркеру, пока он продлевает аренду (extend_task_leases)
+    with _transaction() as cursor:
+        cursor.execute(
+            'UPDATE task SET status = %s, claimed_at = now(), worker_id = %s,'
+            '    lease_expires_at = now() + make_interval(secs => %s), attempts = attempts + 1'
+            ' WHERE id = ('
+            '    SELECT id FROM task WHERE status = %s'
+            '    ORDER BY created_at'
+            '    LIMIT 1'
+            '    FOR UPDATE SKIP LOCKED'
+            ') RETURNING *, extract(epoch FROM claimed_at - created_at)::float AS queue_wait;',
+            (TaskStatus.running.value, worker_id, lease_seconds, TaskStatus.wait.value)
+        )
+        result = cursor.fetchone()
+        if result:
+            return Task(**result)
+        return None
 
 
-def get_waiting_task():
-    with connection.cursor() as cursor:
-        cursor.execute(f'SELECT * FROM task WHERE status = \'WAIT\'')
-        query_result = cursor.fetchone()
-        if query_result:
-            return Task(**query_result)
+def resume_tasks(task_ids: List[str], worker_id: str, lease_seconds: float, max_attempts: int):
+    # Задачи с контрольными точками на этом узле: забираем свои (тот же WORKER_ID после
+    # перезапуска) и чужие с истёкшей арендой, не дожидаясь возврата в очередь
+    with _transaction() as cursor:
+        cursor.execute(
+            'UPDATE task SET worker_id = %s, lease_expires_at = now() + make_interval(secs => %s),'
+            '    attempts = attempts + 1'
+            ' WHERE id = ANY(%s::uuid[]) AND status = %s AND attempts < %s'
+            '    AND (worker_id = %s OR lease_expires_at < now())'
+            ' RETURNING *;',
+            (worker_id, lease_seconds, task_ids, TaskStatus.running.value, max_attempts, worker_id)
+        )
+        results = cursor.fetchall()
+        return [Task(**result) for result in results]
 
-        return query_result
 
+def extend_task_leases(task_ids: List[str], worker_id: str, lease_seconds: float) -> List[str]:
+    # Пульс воркера: продлевается аренда только своих задач. Id, которых нет
+    # в ответе, аренду потеряли — задачу уже забрал другой воркер
+    if not task_ids:
+        return []
+    with _transaction() as cursor:
+        cursor.execute(
+            'UPDATE task SET lease_expires_at = now() + make_interval(secs => %s)'
+            ' WHERE id = ANY(%s::uuid[]) AND worker_id = %s AND status = %s RETURNING id;',
+            (lease_seconds, task_ids, worker_id, TaskStatus.running.value)
+        )
+        results = cursor.fetchall()
+        return [str(result['id']) for result in results]
 
-def set_task_status(task_id: str, status: TaskStatus):
-    with connection.cursor() as cursor:
-        cursor.execute(f'UPDATE task SET status = \'{status.value}\' WHERE id = \'{task_id}\'')
-        connection.commit()
+
+def release_task(task_id: str, worker_id: str, error: str, max_attempts: int) -> Optional[TaskStatus]:
+    # Упавшая задача возвращается в очередь для любого воркера, исчерпавшая попытки — FAILED.
+    # Возврат в очередь будит воркеры тем же NOTIFY, что и новая задача
+    with _transaction() as cursor:
+        cursor.execute(
+            'WITH t AS ('
+            '    UPDATE task SET status = CASE WHEN attempts >= %s THEN %s ELSE %s END,'
+            '        error = %s, worker_id = NULL, lease_expires_at = NULL'
+            f'    WHERE id = %s AND worker_id = %s AND status = %s RETURNING {PROGRESS_EVENT_COLUMNS}'
+            ') SELECT status, CASE WHEN status = %s THEN pg_notify(%s, id::text)'
+            f'    ELSE pg_notify(%s, {PROGRESS_EVENT_JSON}) END::text FROM t;',
+            (max_attempts, TaskStatus.failed.value, TaskStatus.wait.value, error[:2000],
+             task_id, worker_id, TaskStatus.running.value,
+             TaskStatus.wait.value, TASK_CREATED_CHANNEL, TASK_PROGRESS_CHANNEL)
+        )
+        result = cursor.fetchone()
+        return TaskStatus(result['status']) if result else None
+
+
+def reap_expired_tasks(max_attempts: int):
+    # Задачи упавших или зависших воркеров: аренда истекла, пульса нет.
+    # Очистку запускает каждый воркер, SKIP LOCKED не даёт им мешать друг другу
+    with _transaction() as cursor:
+        cursor.execute(
+            'WITH expired AS ('
+            '    SELECT id FROM task WHERE status = %s AND lease_expires_at < now()'
+            '    FOR UPDATE SKIP LOCKED'
+            '), t AS ('
+            '    UPDATE task SET status = CASE WHEN attempts >= %s THEN %s ELSE %s END,'
+            '        error = CASE WHEN attempts >= %s'
+            '            THEN COALESCE(error, %s) ELSE error END,'
+            '        worker_id = NULL, lease_expires_at = NULL'
+            f'    WHERE id IN (SELECT id FROM expired) RETURNING {PROGRESS_EVENT_COLUMNS}'
+            ') SELECT id, status, CASE WHEN status = %s THEN pg_notify(%s, id::text)'
+            f'    ELSE pg_notify(%s, {PROGRESS_EVENT_JSON}) END::text FROM t;',
+            (TaskStatus.running.value, max_attempts, TaskStatus.failed.value, TaskStatus.wait.value,
+             max_attempts, 'Аренда истекла: воркер упал или перестал отвечать',
+             TaskStatus.wait.value, TASK_CREATED_CHANNEL, TASK_PROGRESS_CHANNEL)
+        )
+        results = cursor.fetchall()
+        return results
+
+
+def listen_for_tasks():
+    global listen_connection
+    listen_connection = _connect()
+    listen_connection.set_session(autocommit=True)
+    with listen_connection.cursor() as cursor:
+        cursor.execute(f'LISTEN {TASK_CREATED_CHANNEL};')
+
+
+async def wait_for_task_notification(timeout: float) -> bool:
+    if listen_connection is None or listen_connection.closed:
+        listen_for_tasks()
+
+    loop = asyncio.get_running_loop()
+    notified = asyncio.Event()
+    fd = listen_connection.fileno()
+    loop.add_reader(fd, notified.set)
+    try:
+        await asyncio.wait_for(notified.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        loop.remove_reader(fd)
+
+    try:
+        listen_connection.poll()
+    except psycopg2.OperationalError as e:
+        # Соединение слушателя упало — переподключимся при следующем ожидании
+        logger.warning(f"LISTEN connection lost: {e}")
+        listen_connection.close()
+        return False
+    received = bool(listen_connection.notifies)
+    listen_connection.notifies.clear()
+    return received
+
+
+def publish_progress(task_id: str, stage: str, progress: Optional[float] = None,
+                     status: Optional[TaskStatus] = None):
+    # Снимок прогресса сохраняется в строке задачи (для подписавшихся позже),
+    # событие уходит в NOTIFY тем же запросом и доставляется после коммита
+    with _transaction() as cursor:
+        cursor.execute(
+            'WITH t AS ('
+            '    UPDATE task SET stage = %s, progress = %s, status = COALESCE(%s, status)'
+            f'    WHERE id = %s RETURNING {PROGRESS_EVENT_COLUMNS}'
+            f') SELECT pg_notify(%s, {PROGRESS_EVENT_JSON}) FROM t;',
+            (stage, progress, status.value if status else None, task_id, TASK_PROGRESS_CHANNEL)
+        )
         return cursor.rowcount
 
 
 def get_task(task_id: str):
-    with connection.cursor() as cursor:
+    with _transaction() as cursor:
         cursor.execute(f'SELECT * FROM task WHERE id = %s;', (task_id,))
         result = cursor.fetchone()
         if result:
@@ -64,13 +236,333 @@ def get_task(task_id: str):
 
 
 def set_task_result_url(task_id: str, url: str):
-    with connection.cursor() as cursor:
+    with _transaction() as cursor:
         cursor.execute(f'UPDATE task SET result_url = %s WHERE id = %s', (url, task_id))
-        connection.commit()
         return cursor.rowcount
 
-def get_tasks_by_user(user_id: str):
-    with connection.cursor() as cursor:
-        cursor.execute('SELECT * FROM task WHERE telegram_id = %s ORDER BY id DESC;', (user_id,))
-        results = cursor.fetchall()
-        return results
\ No newline at end of file
+def save_task_timings(task_id: str, timings: dict, finished: bool):
+    # Длительности стадий и ожиданий в секундах — для разбора медленных задач.
+    # finished_at ставится только готовой задаче: упавшая могла вернуться в очередь
+    with _transaction() as cursor:
+        cursor.execute('UPDATE task SET stage_timings = %s,'
+                       '    finished_at = CASE WHEN %s THEN now() ELSE finished_at END WHERE id = %s',
+                       (json.dumps(timings), finished, task_id))
+        return cursor.rowcount
+
+def set_task_manifest_url(task_id: str, url: str):
+    with _transaction() as cursor:
+        cursor.execute('UPDATE task SET manifest_url = %s WHERE id = %s', (url, task_id))
+        return cursor.rowcount
+
+def get_cached_result(audio_hash: str, pipeline_version: str):
+    # Поиск и учёт попадания одним запросом. Возвращает result_url и task_id задачи,
+    # породившей результат (NULL, если её уже удалили)
+    with _transaction() as cursor:
+        cursor.execute(
+            'UPDATE result_cache SET hit_count = hit_count + 1, last_hit_at = now() '
+            'WHERE audio_hash = %s AND pipeline_version = %s RETURNING result_url, task_id;',
+            (audio_hash, pipeline_version)
+        )
+        return cursor.fetchone()
+
+
+def save_cached_result(audio_hash: str, pipeline_version: str, url: str, task_id: str):
+    with _transaction() as cursor:
+        cursor.execute(
+            'INSERT INTO result_cache(audio_hash, pipeline_version, result_url, task_id) VALUES (%s, %s, %s, %s) '
+            'ON CONFLICT (audio_hash, pipeline_version) DO NOTHING;',
+            (audio_hash, pipeline_version, url, task_id)
+        )
+        return cursor.rowcount
+
+
+def purge_result_cache(retention_days: int):
+    with _transaction() as cursor:
+        cursor.execute(
+            'DELETE FROM result_cache WHERE last_hit_at < now() - make_interval(days => %s);',
+            (retention_days,)
+        )
+        return cursor.rowcount
+
+
+def index_transcript(task_id: str, telegram_id: int, segments: list):
+    # segments: [(segment_idx, start, end, speaker, text)]
+    with _transaction() as cursor:
+        cursor.execute('DELETE FROM transcript_segment WHERE task_id = %s;', (task_id,))
+        execute_values(
+            cursor,
+            'INSERT INTO transcript_segment(task_id, telegram_id, segment_idx, start_time, end_time, speaker, text) '
+            'VALUES %s;',
+            [(task_id, telegram_id, *segment) for segment in segments],
+            page_size=1000
+        )
+
+
+def copy_transcript_index(source_task_id: str, task_id: str, telegram_id: int):
+    # Для задачи из кэша результатов копируем индекс задачи, породившей этот результат
+    with _transaction() as cursor:
+        cursor.execute('DELETE FROM transcript_segment WHERE task_id = %s;', (task_id,))
+        cursor.execute(
+            'INSERT INTO transcript_segment(task_id, telegram_id, segment_idx, start_time, end_time, speaker, text) '
+            'SELECT %s, %s, segment_idx, start_time, end_time, speaker, text FROM transcript_segment '
+            'WHERE task_id = %s AND task_id <> %s;',
+            (task_id, telegram_id, source_task_id, task_id)
+        )
+        return cursor.rowcount
+
+
+
+# --- Асинхронный слой для API ---
+
+ADD_TASK_SQL = (
+    'WITH inserted AS ('
+    '    INSERT INTO task(id, file_url, file_name, status, telegram_id)'
+    '    VALUES (uuid_generate_v4(), $1, $2, $3, $4) RETURNING id'
+    ') SELECT id, pg_notify($5, id::text) FROM inserted;'
+)
+# Пачка задач — одна вставка из массивов и одно уведомление на всю пачку:
+# воркер после пробуждения сам выбирает задачи, пока они есть
+ADD_TASKS_SQL = (
+    'WITH inserted AS ('
+    '    INSERT INTO task(id, file_url, file_name, status, telegram_id)'
+    '    SELECT t.id, t.file_url, t.file_name, $4, t.telegram_id'
+    '    FROM unnest($1::uuid[], $2::text[], $3::text[], $5::bigint[]) AS t(id, file_url, file_name, telegram_id)'
+    '    RETURNING id'
+    ') SELECT count(*) AS inserted, pg_notify($6, count(*)::text) FROM inserted;'
+)
+GET_TASK_STATUS_SQL = 'SELECT status FROM task WHERE id = $1;'
+GET_TASK_STATUSES_SQL = 'SELECT id, status, result_url FROM task WHERE id = ANY($1::uuid[]);'
+GET_TASK_SQL = 'SELECT * FROM task WHERE id = $1;'
+# Первая страница и следующие по курсору (created_at, id) последней записи:
+# оба запроса идут по индексу task_user_created_at_idx, цена страницы не зависит от истории
+GET_TASKS_BY_USER_SQL = (
+    f'SELECT {TASK_LIST_COLUMNS} FROM task WHERE telegram_id = $1 '
+    'ORDER BY created_at DESC, id DESC LIMIT $2;'
+)
+GET_TASKS_BY_USER_AFTER_SQL = (
+    f'SELECT {TASK_LIST_COLUMNS} FROM task WHERE telegram_id = $1 AND (created_at, id) < ($2, $3) '
+    'ORDER BY created_at DESC, id DESC LIMIT $4;'
+)
+GET_TASK_PROGRESS_SQL = (
+    'SELECT id AS task_id, telegram_id, status, stage, progress, manifest_url, error FROM task WHERE id = $1;'
+)
+SEARCH_SEGMENTS_SQL = (
+    'WITH q AS (SELECT websearch_to_tsquery(\'russian\', replace(lower($1), \'ё\', \'е\')) AS query) '
+    'SELECT s.task_id, t.file_name, s.segment_idx, s.start_time, s.end_time, s.speaker, '
+    '       ts_headline(\'russian\', s.text, q.query) AS headline, '
+    '       ts_rank_cd(s.tsv, q.query) AS rank '
+    'FROM transcript_segment s JOIN task t ON t.id = s.task_id, q '
+    'WHERE s.telegram_id = $2 AND s.tsv @@ q.query '
+    'ORDER BY rank DESC, s.task_id, s.segment_idx '
+    'LIMIT $3 OFFSET $4;'
+)
+
+# Ошибки, после которых запрос можно повторить на новом соединении
+RETRYABLE_ERRORS = (
+    asyncpg.exceptions.ConnectionDoesNotExistError,
+    asyncpg.exceptions.CannotConnectNowError,
+    asyncpg.exceptions.AdminShutdownError,
+    ConnectionError,
+)
+
+
+def _async_connect_kwargs() -> dict:
+    return dict(
+        user=os.getenv("DB_USER"),
+        password=os.getenv("DB_PASSWORD"),
+        host=os.getenv("DB_HOST"),
+        port=os.getenv("DB_PORT"),
+        database=os.getenv("DB_DBNAME"),
+    )
+
+
+async def _create_pool() -> asyncpg.Pool:
+    return await asyncpg.create_pool(
+        **_async_connect_kwargs(),
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=300
+    )
+
+
+async def init_db_pool():
+    global pool
+    if pool is None:
+        pool = await _create_pool()
+    return pool
+
+
+async def close_db_pool():
+    global pool
+    if pool is not None:
+        await pool.close()
+        pool = None
+
+
+async def check_db_pool() -> bool:
+    try:
+        async with pool.acquire(timeout=DB_HEALTH_TIMEOUT) as conn:
+            return await conn.fetchval('SELECT 1;', timeout=DB_HEALTH_TIMEOUT) == 1
+    except (asyncio.TimeoutError, OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+        return False
+
+
+async def db_pool_health_loop():
+    global pool
+    while True:
+        await asyncio.sleep(DB_HEALTH_INTERVAL)
+        if pool is not None and await check_db_pool():
+            continue
+        # Все соединения могли умереть разом (рестарт или failover базы) — пересоздаём пул
+        logger.warning("Database pool is unhealthy, reconnecting")
+        # Старый пул заменяется только готовым новым: запросы в это время
+        # получают ошибку соединения, а не AttributeError на pool = None
+        try:
+            new_pool = await _create_pool()
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.error(f"Failed to connect: {e}")
+            continue
+        old_pool, pool = pool, new_pool
+        if old_pool is not None:
+            old_pool.terminate()
+
+
+async def listen_async(channel: str, callback):
+    # Отдельное соединение вне пула: LISTEN держит его всё время жизни процесса
+    while True:
+        lost = asyncio.Event()
+        try:
+            conn = await asyncpg.connect(**_async_connect_kwargs())
+        except (OSError, asyncpg.PostgresError) as e:
+            logger.warning(f"LISTEN {channel} failed to connect: {e}")
+            await asyncio.sleep(DB_HEALTH_INTERVAL)
+            continue
+        conn.add_termination_listener(lambda _: lost.set())
+        try:
+            await conn.add_listener(channel, lambda _conn, _pid, _channel, payload: callback(payload))
+            # Проверяем соединение с тем же интервалом, что и пул
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), DB_HEALTH_INTERVAL)
+                except asyncio.TimeoutError:
+                    await conn.fetchval('SELECT 1;', timeout=DB_HEALTH_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            logger.warning(f"LISTEN {channel} connection lost: {e}")
+        finally:
+            conn.terminate()
+
+
+async def _fetch(method: str, query: str, *args, retry: bool = True):
+    attempts = 2 if retry else 1
+    for attempt in range(attempts):
+        try:
+            async with pool.acquire() as conn:
+                return await getattr(conn, method)(query, *args)
+        except RETRYABLE_ERRORS:
+            if attempt == attempts - 1:
+                raise
+
+
+def _record(record) -> Optional[dict]:
+    if record is None:
+        return None
+    return {key: str(value) if isinstance(value, uuid.UUID) else value for key, value in record.items()}
+
+
+def _as_uuid(value: str) -> Optional[uuid.UUID]:
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+async def add_task_async(query: TranscribeQuery):
+    # Вставка и NOTIFY одним запросом; не повторяем — вставка могла пройти
+    record = await _fetch('fetchrow', ADD_TASK_SQL, query.file_url, query.file_name,
+                          TaskStatus.wait.value, query.telegram_id, TASK_CREATED_CHANNEL, retry=False)
+    return {"id": str(record["id"])}
+
+
+async def add_tasks_async(queries: List[TranscribeQuery]):
+    # id генерируем здесь, чтобы вернуть их в порядке запроса
+    ids = [uuid.uuid4() for _ in queries]
+    await _fetch('fetchrow', ADD_TASKS_SQL, ids,
+                 [q.file_url for q in queries], [q.file_name for q in queries],
+                 TaskStatus.wait.value, [q.telegram_id for q in queries],
+                 TASK_CREATED_CHANNEL, retry=False)
+    return {"ids": [str(task_id) for task_id in ids]}
+
+
+async def get_task_statuses_async(task_ids: List[str]):
+    # Невалидные и неизвестные id возвращаются со status = None, порядок — как в запросе
+    uuids = [_as_uuid(task_id) for task_id in task_ids]
+    valid = [task_uuid for task_uuid in uuids if task_uuid is not None]
+    records = await _fetch('fetch', GET_TASK_STATUSES_SQL, valid) if valid else []
+    found = {r['id']: r for r in records}
+    items = []
+    for task_id, task_uuid in zip(task_ids, uuids):
+        record = found.get(task_uuid)
+        items.append({
+            "id": task_id,
+            "status": record['status'] if record else None,
+            "result_url": record['result_url'] if record else None,
+        })
+    return items
+
+
+async def get_task_status_async(task_id: str):
+    task_uuid = _as_uuid(task_id)
+    if task_uuid is None:
+        return None
+    return _record(await _fetch('fetchrow', GET_TASK_STATUS_SQL, task_uuid))
+
+
+async def get_task_async(task_id: str):
+    task_uuid = _as_uuid(task_id)
+    if task_uuid is None:
+        return None
+    result = await _fetch('fetchrow', GET_TASK_SQL, task_uuid)
+    if result:
+        return Task(**_record(result))
+    return None
+
+
+def encode_cursor(created_at: datetime, task_id) -> str:
+    raw = f'{created_at.isoformat()}|{task_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    # Непрозрачный курсор от клиента: ValueError, если его подделали или испортили
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, task_id = raw.split('|')
+        return datetime.fromisoformat(created_at), uuid.UUID(task_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Некорректный курсор')
+
+
+async def get_tasks_by_user_async(telegram_id: int, limit: int, cursor: Optional[str] = None):
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+    if cursor is None:
+        records = await _fetch('fetch', GET_TASKS_BY_USER_SQL, telegram_id, limit + 1)
+    else:
+        created_at, task_id = decode_cursor(cursor)
+        records = await _fetch('fetch', GET_TASKS_BY_USER_AFTER_SQL, telegram_id, created_at, task_id, limit + 1)
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        next_cursor = encode_cursor(records[-1]['created_at'], records[-1]['id'])
+    return {"items": [_record(r) for r in records], "next_cursor": next_cursor}
+
+
+async def get_task_progress_async(task_id: str):
+    task_uuid = _as_uuid(task_id)
+    if task_uuid is None:
+        return None
+    return _record(await _fetch('fetchrow', GET_TASK_PROGRESS_SQL, task_uuid))
+
+
+async def search_segments_async(telegram_id: int, query: str, limit: int, offset: int):
+    return [_record(r) for r in await _fetch('fetch', SEARCH_SEGMENTS_SQL, query, telegram_id, limit, offset)]
@@ -1,11 +1,17 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
 import enum
+import os
+
+# Сколько задач бот может отправить или проверить одним запросом
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 500))
 
 
 class TaskStatus(enum.Enum):
     wait = 'WAIT'
     running = 'RUNNING'
     finished = 'FINISHED'
+    failed = 'FAILED'
 
 
 class TranscribeQuery(BaseModel):
@@ -14,13 +20,31 @@ class TranscribeQuery(BaseModel):
     telegram_id: int
 
 
+class TranscribeBatchQuery(BaseModel):
+    tasks: List[TranscribeQuery] = Field(min_length=1, max_length=BATCH_MAX_SIZE)
+
+
+class StatusBatchQuery(BaseModel):
+    ids: List[str] = Field(min_length=1, max_length=BATCH_MAX_SIZE)
+
+
+class ExportQuery(BaseModel):
+    format: Literal['docx', 'pdf'] = 'docx'
+    speaker_names: Optional[Dict[str, str]] = None
+
+
 class Task(BaseModel):
     id: str
     file_url: str
     file_name: str
     status: TaskStatus
     result_url: str | None = None
+    manifest_url: str | None = None
     telegram_id: int
+    # Секунды от создания до захвата; заполняется только в claim_task
+    queue_wait: float | None = None
+    attempts: int = 0
+    error: str | None = None
 
 class TokenPair(BaseModel):
     access_token: str
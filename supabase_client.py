@@ -1,15 +1,8 @@
 import os
-from supabase import create_client
-from datetime import datetime, timedelta, timezone
 from typing import Optional, Any
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-SUPABASE_BUCKET = os.getenv("SUPABASE_BUCKET", "transcriptions")
+from auth.cache import telegram_id_cache
 
 USERS_TABLE = os.getenv("SUPABASE_USERS_TABLE", "users")
-ONE_TIME_TOKENS_TABLE = os.getenv("SUPABASE_ONE_TIME_TOKENS_TABLE", "one_time_tokens")
-REFRESH_TOKENS_TABLE = os.getenv("SUPABASE_REFRESH_TOKENS_TABLE", "refresh_tokens")
 
 supabase_conn: Any = None
 
@@ -17,7 +10,9 @@ def init_supabase_client():
     global supabase_conn
     try:
         if supabase_conn is None:
-            supabase_conn = create_client(SUPABASE_URL, SUPABASE_KEY)  # type: ignore[arg-type]
+            # SDK и настройки подключения — при первом обращении к Supabase, не при импорте
+            from supabase import create_client
+            supabase_conn = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))  # type: ignore[arg-type]
     except Exception as e:
         print(f"Failed to connect: {e}")
 
@@ -31,8 +26,18 @@ def upload_file_to_supabase(file_path: str, bucket: str, dest_name, content_type
     return public_url
 
 
-def _now_utc() -> datetime:
-    return datetime.now(timezone.utc)
+def upload_bytes_to_supabase(data: bytes, bucket: str, dest_name, content_type: str = "application/octet-stream",
+                             upsert: bool = False, cache_control: Optional[str] = None) -> str:
+    global supabase_conn
+    if supabase_conn is None:
+        init_supabase_client()
+    options = {"content-type": content_type}
+    if upsert:
+        options["upsert"] = "true"
+    if cache_control is not None:
+        options["cache-control"] = cache_control
+    supabase_conn.storage.from_(bucket).upload(dest_name, data, options)
+    return supabase_conn.storage.from_(bucket).get_public_url(dest_name)
 
 
 def _ensure_client():
@@ -41,106 +46,62 @@ def _ensure_client():
         init_supabase_client()
 
 
-def get_user_by_telegram_id(telegram_id: int) -> Optional[dict]:
-    _ensure_client()
-    result = (
-        supabase_conn
-        .table(USERS_TABLE)
-        .select("*")
-        .eq("telegram_id", telegram_id)
-        .limit(1)
-        .execute()
-    )
-    return result.data[0] if result.data else None
-
-
-def create_user(telegram_id: int) -> dict:
-    _ensure_client()
-    email = f"{telegram_id}@tg.laterlistener.com"
-    insert = {
-        "telegram_id": telegram_id,
-        "email": email,
-    }
-    result = supabase_conn.table(USERS_TABLE).insert(insert).execute()
-    return result.data[0]
+def _remember_user(user: dict):
+    # Сразу после входа фронтенд ходит в API — связка user_id → telegram_id уже будет в кэше
+    telegram_id_cache.set(str(user["id"]), user["telegram_id"])
 
 
 def save_one_time_token(token_hash: str, telegram_id: int, ttl_seconds: int) -> None:
     _ensure_client()
-    now = _now_utc()
-    supabase_conn.table(ONE_TIME_TOKENS_TABLE).delete().or_(
-        f"telegram_id.eq.{telegram_id},expires_at.lt.{now.isoformat()}"
-    ).execute()
-
-    expires_at = _now_utc() + timedelta(seconds=ttl_seconds)
-    record = {
-        "token_hash": token_hash,
-        "telegram_id": telegram_id,
-        "expires_at": expires_at.isoformat(),
-    }
-    supabase_conn.table(ONE_TIME_TOKENS_TABLE).insert(record).execute()
-
-
-def get_one_time_token(token_hash: str) -> Optional[dict]:
-    _ensure_client()
-    result = (
-        supabase_conn
-        .table(ONE_TIME_TOKENS_TABLE)
-        .select("*")
-        .eq("token_hash", token_hash)
-        .limit(1)
-        .execute()
-    )
-    return result.data[0] if result.data else None
-
-
-def delete_one_time_token(token_hash: str):
-    _ensure_client()
-    supabase_conn.table(ONE_TIME_TOKENS_TABLE).delete().eq("token_hash", token_hash).execute()
+    # Замена прежнего токена пользователя и вставка — одна транзакция в базе
+    supabase_conn.rpc("issue_one_time_token", {
+        "p_token_hash": token_hash,
+        "p_telegram_id": telegram_id,
+        "p_ttl_seconds": ttl_seconds,
+    }).execute()
 
 
-def _purge_old_refresh_tokens(user_id: str):
+def exchange_one_time_token(token_hash: str) -> dict:
     _ensure_client()
+    # Погашение токена и get-or-create пользователя за один запрос:
+    # {"status": "ok" | "invalid" | "expired", "user": {...}}
+    result = supabase_conn.rpc("exchange_one_time_token", {"p_token_hash": token_hash}).execute().data
+    if result.get("user"):
+        # Пользователь мог быть только что создан внутри RPC
+        _remember_user(result["user"])
+    return result
 
-    # 1. Удаляем все токены конкретного пользователя — им на смену придёт новый
-    supabase_conn.table(REFRESH_TOKENS_TABLE).delete().eq("user_id", user_id).execute()
-
-    # 2. Дополнительно удаляем все глобально просроченные токены
-    now_iso = _now_utc().isoformat()
-    supabase_conn.table(REFRESH_TOKENS_TABLE).delete().lt("expires_at", now_iso).execute()
 
 def save_refresh_token(token_hash: str, user_id: str, ttl_seconds: int):
     _ensure_client()
-    # Сначала чистим старые записи
-    _purge_old_refresh_tokens(user_id)
-
-    expires_at = _now_utc() + timedelta(seconds=ttl_seconds)
-    record = {
-        "token_hash": token_hash,
-        "user_id": user_id,
-        "expires_at": expires_at.isoformat(),
-    }
-    supabase_conn.table(REFRESH_TOKENS_TABLE).insert(record).execute()
+    # Старые токены пользователя удаляются в той же транзакции
+    supabase_conn.rpc("store_refresh_token", {
+        "p_token_hash": token_hash,
+        "p_user_id": user_id,
+        "p_ttl_seconds": ttl_seconds,
+    }).execute()
 
 
-def get_refresh_token(token_hash: str) -> Optional[dict]:
+def rotate_refresh_token(old_hash: str, new_hash: str, user_id: str, ttl_seconds: int) -> str:
     _ensure_client()
-    result = (
-        supabase_conn
-        .table(REFRESH_TOKENS_TABLE)
-        .select("*")
-        .eq("token_hash", token_hash)
-        .limit(1)
-        .execute()
-    )
-    return result.data[0] if result.data else None
+    # Проверка, отзыв старого и сохранение нового токена: "ok" | "invalid" | "expired"
+    return supabase_conn.rpc("rotate_refresh_token", {
+        "p_old_hash": old_hash,
+        "p_new_hash": new_hash,
+        "p_user_id": user_id,
+        "p_ttl_seconds": ttl_seconds,
+    }).execute().data
 
 
-def revoke_refresh_token(token_hash: str):
+def purge_expired_tokens() -> dict:
     _ensure_client()
-    supabase_conn.table(REFRESH_TOKENS_TABLE).update({"revoked_at": _now_utc().isoformat()}).eq("token_hash", token_hash).execute()
+    return supabase_conn.rpc("purge_expired_tokens", {}).execute().data
+
 
 def get_telegram_id_by_user_id(user_id: str) -> Optional[int]:
+    telegram_id = telegram_id_cache.get(user_id)
+    if telegram_id is not None:
+        return telegram_id
     _ensure_client()
     result = (
         supabase_conn
@@ -151,5 +112,8 @@ def get_telegram_id_by_user_id(user_id: str) -> Optional[int]:
         .execute()
     )
     if result.data and len(result.data) > 0:
-        return result.data[0].get("telegram_id")
+        telegram_id = result.data[0].get("telegram_id")
+        if telegram_id is not None:
+            telegram_id_cache.set(user_id, telegram_id)
+        return telegram_id
     return None
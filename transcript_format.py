@@ -0,0 +1,177 @@
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional
+import gzip
+import json
+import os
+import struct
+import sys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Компактный колоночный формат расшифровки:
+#   заголовок  <4s B B H I>: magic, версия, кодек, резерв, длина несжатого тела
+#   тело       <I I>: число спикеров и сегментов,
+#              таблица спикеров (u16 длина + utf-8),
+#              start/end float32[n], индекс спикера uint16[n] (0xFFFF — без спикера),
+#              смещения текста uint32[n + 1], склеенный текст utf-8
+MAGIC = b"LLTR"
+FORMAT_VERSION = 1
+CODEC_NONE, CODEC_GZIP, CODEC_ZSTD = 0, 1, 2
+CODECS = {"none": CODEC_NONE, "gzip": CODEC_GZIP, "zstd": CODEC_ZSTD}
+CONTENT_TYPE = "application/x-laterlistener-transcript"
+NO_SPEAKER = 0xFFFF
+
+HEADER = struct.Struct("<4sBBHI")
+COUNTS = struct.Struct("<II")
+
+TRANSCRIPT_COMPRESSION = os.getenv("TRANSCRIPT_COMPRESSION", "zstd" if zstandard else "gzip")
+
+
+class TranscriptEncoder:
+    # Сегменты добавляются по одному, копятся в плотных массивах, а не в словарях
+    def __init__(self):
+        self._speakers: Dict[str, int] = {}
+        self._starts = array("f")
+        self._ends = array("f")
+        self._speaker_idx = array("H")
+        self._offsets = array("I", [0])
+        self._text = bytearray()
+
+    def add(self, segment: Dict):
+        speaker = segment.get("speaker")
+        if speaker is None:
+            idx = NO_SPEAKER
+        else:
+            idx = self._speakers.setdefault(speaker, len(self._speakers))
+        self._starts.append(segment["start"])
+        self._ends.append(segment["end"])
+        self._speaker_idx.append(idx)
+        self._text += segment["word"].encode("utf-8")
+        self._offsets.append(len(self._text))
+
+    def finish(self, compression: str = TRANSCRIPT_COMPRESSION) -> bytes:
+        parts = [COUNTS.pack(len(self._speakers), len(self._starts))]
+        for speaker in self._speakers:
+            encoded = speaker.encode("utf-8")
+            parts.append(struct.pack("<H", len(encoded)) + encoded)
+        for column in (self._starts, self._ends, self._speaker_idx, self._offsets):
+            if sys.byteorder != "little":
+                column = array(column.typecode, column)
+                column.byteswap()
+            parts.append(column.tobytes())
+        parts.append(bytes(self._text))
+        body = b"".join(parts)
+
+        codec = CODECS[compression]
+        if codec == CODEC_ZSTD and zstandard is None:
+            codec = CODEC_GZIP
+        if codec == CODEC_ZSTD:
+            payload = zstandard.ZstdCompressor(level=10).compress(body)
+        elif codec == CODEC_GZIP:
+            payload = gzip.compress(body, compresslevel=6)
+        else:
+            payload = body
+        return HEADER.pack(MAGIC, FORMAT_VERSION, codec, 0, len(body)) + payload
+
+
+def encode_transcript(segments: Iterable[Dict], compression: str = TRANSCRIPT_COMPRESSION) -> bytes:
+    encoder = TranscriptEncoder()
+    for segment in segments:
+        encoder.add(segment)
+    return encoder.finish(compression)
+
+
+def _read_column(body: memoryview, offset: int, typecode: str, count: int):
+    column = array(typecode)
+    size = column.itemsize * count
+    column.frombytes(body[offset:offset + size])
+    if sys.byteorder != "little":
+        column.byteswap()
+    return column, offset + size
+
+
+class CompactTranscript:
+    def __init__(self, data: bytes):
+        magic, version, codec, _, body_length = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("Не компактный формат расшифровки")
+        if version > FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия формата: {version}")
+        payload = data[HEADER.size:]
+        if codec == CODEC_ZSTD:
+            if zstandard is None:
+                raise RuntimeError("Для чтения нужен пакет zstandard")
+            body = zstandard.ZstdDecompressor().decompress(payload, max_output_size=body_length)
+        elif codec == CODEC_GZIP:
+            body = gzip.decompress(payload)
+        else:
+            body = payload
+        body = memoryview(body)
+
+        n_speakers, n_segments = COUNTS.unpack_from(body)
+        offset = COUNTS.size
+        self.speakers: List[str] = []
+        for _ in range(n_speakers):
+            (length,) = struct.unpack_from("<H", body, offset)
+            offset += 2
+            self.speakers.append(bytes(body[offset:offset + length]).decode("utf-8"))
+            offset += length
+        self.starts, offset = _read_column(body, offset, "f", n_segments)
+        self.ends, offset = _read_column(body, offset, "f", n_segments)
+        self.speaker_idx, offset = _read_column(body, offset, "H", n_segments)
+        self.text_offsets, offset = _read_column(body, offset, "I", n_segments + 1)
+        self._text = body[offset:]
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, i: int) -> Dict:
+        if i < 0:
+            i += len(self)
+        idx = self.speaker_idx[i]
+        return {
+            "start": self.starts[i],
+            "end": self.ends[i],
+            "speaker": None if idx == NO_SPEAKER else self.speakers[idx],
+            "word": bytes(self._text[self.text_offsets[i]:self.text_offsets[i + 1]]).decode("utf-8")
+        }
+
+    def __iter__(self) -> Iterator[Dict]:
+        return (self[i] for i in range(len(self)))
+
+    def to_list(self) -> List[Dict]:
+        return list(self)
+
+
+class JsonTranscript:
+    # Старые результаты в JSON: разбираются только при первом обращении
+    def __init__(self, data: bytes):
+        self._data = data
+        self._segments: Optional[List[Dict]] = None
+
+    def _load(self) -> List[Dict]:
+        if self._segments is None:
+            self._segments = json.loads(self._data)
+            self._data = None
+        return self._segments
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def __getitem__(self, i: int) -> Dict:
+        return self._load()[i]
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self._load())
+
+    def to_list(self) -> List[Dict]:
+        return self._load()
+
+
+def load_transcript(data: bytes):
+    if data[:len(MAGIC)] == MAGIC:
+        return CompactTranscript(data)
+    return JsonTranscript(data)
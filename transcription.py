@@ -1,17 +1,199 @@
-from openai import OpenAI
-from typing import Dict, List
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Tuple
+import numpy as np
+import asyncio
+import wave
+import io
 import os
 
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+WHISPER_MODEL = "whisper-1"
+# Длина куска держит WAV 16 кГц моно под лимитом API в 25 МБ
+TRANSCRIPTION_CHUNK_SECONDS = float(os.getenv("TRANSCRIPTION_CHUNK_SECONDS", 600))
+TRANSCRIPTION_CHUNK_OVERLAP = float(os.getenv("TRANSCRIPTION_CHUNK_OVERLAP", 2))
+TRANSCRIPTION_SILENCE_SEARCH = float(os.getenv("TRANSCRIPTION_SILENCE_SEARCH", 30))
+TRANSCRIPTION_MAX_IN_FLIGHT = int(os.getenv("TRANSCRIPTION_MAX_IN_FLIGHT", 4))
+ENERGY_FRAME_SECONDS = 0.05
+# Одно и то же слово на стыке кусков может получить чуть разные таймкоды
+DUPLICATE_WORD_TOLERANCE = 0.5
+
+# Вызывается по готовности каждого куска: (номер, всего кусков, начало, конец, слова куска)
+ChunkCallback = Callable[[int, int, float, float, List[Dict]], Awaitable[None]]
+# Сырые слова куска (с перекрытием) по (номер, начало, конец): готовые куски
+# не отправляются в API повторно при повторе стадии или после перезапуска
+ChunkLoader = Callable[[int, float, float], Optional[List[Dict]]]
+ChunkSaver = Callable[[int, float, float, List[Dict]], None]
+
 
 def transcription(audio_path: str) -> List[Dict]:
+    from openai import OpenAI
     client = OpenAI(api_key=os.getenv("OPENAI_KEY"))
-    audio_file = open(audio_path, "rb")
-
-    transcription_obj = client.audio.transcriptions.create(
-        file=audio_file,
-        model="whisper-1",
-        response_format="verbose_json",
-        timestamp_granularities=["word"]
-    )
+    with open(audio_path, "rb") as audio_file:
+        transcription_obj = client.audio.transcriptions.create(
+            file=audio_file,
+            model=WHISPER_MODEL,
+            response_format="verbose_json",
+            timestamp_granularities=["word"]
+        )
 
     return transcription_obj.dict()['words']
+
+
+def _frame_energies(audio_path: str) -> Tuple[np.ndarray, int, int]:
+    # RMS по кадрам 50 мс, файл читается блоками — в памяти только массив энергий
+    with wave.open(audio_path, "rb") as wf:
+        rate = wf.getframerate()
+        channels = wf.getnchannels()
+        total = wf.getnframes()
+        frame = int(rate * ENERGY_FRAME_SECONDS)
+        block_frames = frame * 200
+        energies = []
+        while True:
+            data = wf.readframes(block_frames)
+            if not data:
+                break
+            samples = np.frombuffer(data, dtype=np.int16).astype(np.float32)
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1)
+            usable = len(samples) - len(samples) % frame
+            if usable:
+                energies.append(np.sqrt(np.mean(samples[:usable].reshape(-1, frame) ** 2, axis=1)))
+            if usable < len(samples):
+                energies.append(np.sqrt(np.mean(samples[usable:] ** 2, keepdims=True)))
+    energies = np.concatenate(energies) if energies else np.zeros(0, dtype=np.float32)
+    return energies, rate, total
+
+
+def plan_chunks(audio_path: str,
+                chunk_seconds: float = TRANSCRIPTION_CHUNK_SECONDS,
+                search_seconds: float = TRANSCRIPTION_SILENCE_SEARCH) -> List[float]:
+    # Точки разреза: 0, ..., длительность. Каждый разрез — самый тихий кадр
+    # в окне перед целевой длиной куска
+    energies, rate, total = _frame_energies(audio_path)
+    duration = total / rate
+    cuts = [0.0]
+    while duration - cuts[-1] > chunk_seconds:
+        target = cuts[-1] + chunk_seconds
+        lo = int(max(cuts[-1] + 1, target - search_seconds) / ENERGY_FRAME_SECONDS)
+        hi = int(target / ENERGY_FRAME_SECONDS)
+        quietest = lo + int(np.argmin(energies[lo:hi])) if hi > lo else hi
+        cuts.append((quietest + 0.5) * ENERGY_FRAME_SECONDS)
+    cuts.append(duration)
+    return cuts
+
+
+def _read_chunk(audio_path: str, start: float, end: float) -> bytes:
+    with wave.open(audio_path, "rb") as wf:
+        rate = wf.getframerate()
+        wf.setpos(int(start * rate))
+        frames = wf.readframes(int((end - start) * rate))
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as out:
+            out.setnchannels(wf.getnchannels())
+            out.setsampwidth(wf.getsampwidth())
+            out.setframerate(rate)
+            out.writeframes(frames)
+    return buffer.getvalue()
+
+
+async def _transcribe_chunk(client: "AsyncOpenAI", semaphore: asyncio.Semaphore,
+                            audio_path: str, start: float, end: float) -> List[Dict]:
+    async with semaphore:
+        # Кусок читается только когда для него есть слот — в памяти не больше N кусков
+        data = await asyncio.to_thread(_read_chunk, audio_path, start, end)
+        transcription_obj = await client.audio.transcriptions.create(
+            file=(f"chunk_{start:.0f}.wav", data),
+            model=WHISPER_MODEL,
+            response_format="verbose_json",
+            timestamp_granularities=["word"]
+        )
+    words = transcription_obj.dict()['words'] or []
+    return [{**word, "start": word["start"] + start, "end": word["end"] + start} for word in words]
+
+
+def _owned_words(cuts: List[float], i: int, words: List[Dict]) -> List[Dict]:
+    # Слова, начавшиеся в [cuts[i], cuts[i+1]) — для предварительного показа куска.
+    # Итоговая склейка — merge_chunk_words: слово у разреза здесь может потеряться
+    own_start, own_end = cuts[i], cuts[i + 1]
+    last = i == len(cuts) - 2
+    return [word for word in words
+            if word["start"] >= own_start and (word["start"] < own_end or last)]
+
+
+def merge_chunk_words(cuts: List[float], chunk_words: List[List[Dict]]) -> List[Dict]:
+    # Из куска i берутся слова до разреза, из следующего — слова после конца последнего
+    # принятого (с допуском: у соседних кусков таймкоды одного слова расходятся).
+    # Слово у самого разреза, попавшее по разные стороны в двух кусках, не теряется,
+    # а попавшее в оба — отбрасывается как дубль
+    merged = []
+    for i, words in enumerate(chunk_words):
+        last = i == len(chunk_words) - 1
+        after = merged[-1]["end"] - DUPLICATE_WORD_TOLERANCE if merged else float("-inf")
+        for word in words:
+            if word["start"] < after or (not last and word["start"] >= cuts[i + 1]):
+                continue
+            if _is_duplicate(merged, word):
+                continue
+            merged.append(word)
+    return merged
+
+
+def _is_duplicate(merged: List[Dict], word: Dict) -> bool:
+    # Дубль ищется среди последних принятых слов, начавшихся в пределах допуска
+    text = word["word"].strip().lower()
+    for previous in reversed(merged):
+        if previous["start"] <= word["start"] - DUPLICATE_WORD_TOLERANCE:
+            return False
+        if previous["word"].strip().lower() == text:
+            return True
+    return False
+
+
+async def transcription_chunked(audio_path: str,
+                                max_in_flight: int = TRANSCRIPTION_MAX_IN_FLIGHT,
+                                overlap: float = TRANSCRIPTION_CHUNK_OVERLAP,
+                                on_chunk: Optional[ChunkCallback] = None,
+                                load_chunk: Optional[ChunkLoader] = None,
+                                save_chunk: Optional[ChunkSaver] = None) -> List[Dict]:
+    cuts = await asyncio.to_thread(plan_chunks, audio_path)
+    duration = cuts[-1]
+    semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def run(client: "AsyncOpenAI", i: int) -> List[Dict]:
+        words = None
+        if load_chunk is not None:
+            words = await asyncio.to_thread(load_chunk, i, cuts[i], cuts[i + 1])
+        if words is None:
+            words = await _transcribe_chunk(client, semaphore, audio_path,
+                                            max(0.0, cuts[i] - overlap), min(duration, cuts[i + 1] + overlap))
+            if save_chunk is not None:
+                await asyncio.to_thread(save_chunk, i, cuts[i], cuts[i + 1], words)
+        if on_chunk is not None:
+            await on_chunk(i, len(cuts) - 1, cuts[i], cuts[i + 1], _owned_words(cuts, i, words))
+        return words
+
+    # SDK OpenAI импортируется при первой транскрибации, а не при старте воркера
+    from openai import AsyncOpenAI
+    async with AsyncOpenAI(api_key=os.getenv("OPENAI_KEY")) as client:
+        chunk_words = await asyncio.gather(*(run(client, i) for i in range(len(cuts) - 1)),
+                                           return_exceptions=True)
+    # Ждём все куски, даже если один упал: остальные успеют сохраниться, а повтор
+    # стадии не пересечётся с ещё идущими запросами
+    for result in chunk_words:
+        if isinstance(result, BaseException):
+            raise result
+    return merge_chunk_words(cuts, chunk_words)
+
+
+async def transcribe_audio(audio_path: str, duration: Optional[float] = None,
+                           on_chunk: Optional[ChunkCallback] = None,
+                           load_chunk: Optional[ChunkLoader] = None,
+                           save_chunk: Optional[ChunkSaver] = None) -> List[Dict]:
+    if duration is not None and duration <= TRANSCRIPTION_CHUNK_SECONDS:
+        words = await asyncio.to_thread(transcription, audio_path)
+        if on_chunk is not None:
+            await on_chunk(0, 1, 0.0, duration, words)
+        return words
+    return await transcription_chunked(audio_path, on_chunk=on_chunk,
+                                       load_chunk=load_chunk, save_chunk=save_chunk)
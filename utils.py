@@ -2,13 +2,21 @@ import os
 import logging
 import hashlib
 import wave
-from typing import Optional
+import json
+from typing import Any, Optional, TextIO
 
 SUPPORTED_AUDIO_FORMATS = (".mp3", ".m4a", ".wav", ".ogg", ".webm")
 
 
 LOG_DIR = "logs"
-os.makedirs(LOG_DIR, exist_ok=True) 
+
+
+class _LogFileHandler(logging.FileHandler):
+    # Каталог и файл лога создаются при первой записи, а не при импорте модуля
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
 
 def get_logger(name: str = "general") -> logging.Logger:
     logger = logging.getLogger(f"transcriber.{name}")
@@ -25,9 +33,8 @@ def get_logger(name: str = "general") -> logging.Logger:
     stream_handler.setFormatter(formatter)
     logger.addHandler(stream_handler)
 
- 
     log_file = os.path.join(LOG_DIR, f"{name}.log")
-    file_handler = logging.FileHandler(log_file, encoding="utf-8")
+    file_handler = _LogFileHandler(log_file, encoding="utf-8", delay=True)
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
 
@@ -71,3 +78,21 @@ def safe_remove(file_path: str):
             get_logger("utils").info(f"Удалён временный файл: {file_path}")
     except Exception as e:
         get_logger("utils").warning(f"Не удалось удалить файл: {file_path} — {e}")
+
+
+class JsonArrayWriter:
+    # Пишет JSON-массив поэлементно: в памяти не держится ничего, кроме текущего элемента
+    def __init__(self, f: TextIO):
+        self._f = f
+        self._count = 0
+        self._f.write("[")
+
+    def write(self, item: Any):
+        if self._count:
+            self._f.write(",")
+        self._f.write(json.dumps(item, ensure_ascii=False))
+        self._count += 1
+
+    def close(self) -> int:
+        self._f.write("]")
+        return self._count
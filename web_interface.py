@@ -1,94 +1,254 @@
-from dotenv import load_dotenv
-
-load_dotenv()
-
-from fastapi import FastAPI, Response, HTTPException, Depends
+from fastapi import APIRouter, FastAPI, Request, Response, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
-from schema import TaskStatus, TranscribeQuery, TokenPair, OneTimeTokenQuery
-from psdb_client import init_db_client, add_task, get_task_status, get_task, get_tasks_by_user
+from schema import (
+    TaskStatus,
+    TranscribeQuery,
+    TranscribeBatchQuery,
+    StatusBatchQuery,
+    ExportQuery,
+    TokenPair,
+    OneTimeTokenQuery
+)
+from psdb_client import (
+    init_db_pool,
+    close_db_pool,
+    db_pool_health_loop,
+    add_task_async,
+    add_tasks_async,
+    get_task_status_async,
+    get_task_statuses_async,
+    get_task_async,
+    get_tasks_by_user_async,
+    get_task_progress_async,
+    search_segments_async
+)
+from progress_hub import subscribe, unsubscribe, run_progress_listener
+from fastapi.responses import StreamingResponse, FileResponse
+from export_service import MEDIA_TYPES, export_transcript, export_cache_janitor, stop_export_pool
+from downloader import close_http_client
+from metrics import HTTP_REQUEST_SECONDS, render_metrics
+import time
+import json
 from contextlib import asynccontextmanager
-
-from supabase_client import upload_file_to_supabase
+from starlette.concurrency import run_in_threadpool
+import asyncio
 
 import os
-from supabase import create_client, Client
 
 from auth.security import (
+    REFRESH_TOKEN_TTL,
     create_access_token,
     create_refresh_token,
     get_current_user_id,
-    verify_service_token
+    verify_service_token,
+    _decode_token
 )
+from auth.cache import cache_stats
+from utils import get_logger
 
 from supabase_client import (
     save_one_time_token,
-    get_one_time_token,
-    delete_one_time_token,
-    get_user_by_telegram_id,
-    create_user,
+    exchange_one_time_token,
     save_refresh_token,
-    get_refresh_token,
-    revoke_refresh_token,
+    rotate_refresh_token,
+    purge_expired_tokens,
     get_telegram_id_by_user_id
 )
 
+from typing import Optional
 import secrets
 import hashlib
-from datetime import datetime, timezone
+
+ONE_TIME_TOKEN_TTL = int(os.getenv("ONE_TIME_TOKEN_TTL", 600))
+SEARCH_MAX_LIMIT = 100
+TRANSCRIPTS_PAGE_SIZE = int(os.getenv("TRANSCRIPTS_PAGE_SIZE", 20))
+TRANSCRIPTS_MAX_PAGE_SIZE = int(os.getenv("TRANSCRIPTS_MAX_PAGE_SIZE", 100))
+TOKEN_JANITOR_INTERVAL = float(os.getenv("TOKEN_JANITOR_INTERVAL", 3600))
+# Комментарий-пинг в SSE, чтобы прокси не закрывали простаивающий поток
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", 15))
+logger = get_logger("api")
+# После этих статусов событий по задаче больше не будет
+FINAL_STATUSES = (TaskStatus.finished.value, TaskStatus.failed.value)
+
+
+async def token_janitor():
+    while True:
+        try:
+            await run_in_threadpool(purge_expired_tokens)
+        except Exception as e:
+            logger.warning(f"Failed to purge expired tokens: {e}")
+        await asyncio.sleep(TOKEN_JANITOR_INTERVAL)
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    init_db_client()
+    await init_db_pool()
+    background = [
+        asyncio.create_task(db_pool_health_loop()),
+        asyncio.create_task(token_janitor()),
+        asyncio.create_task(run_progress_listener()),
+        asyncio.create_task(export_cache_janitor()),
+    ]
     yield
+    for task in background:
+        task.cancel()
+    stop_export_pool()
+    await close_http_client()
+    await close_db_pool()
 
-app = FastAPI(lifespan=lifespan)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["https://139.59.145.185"],  #список разрешённых доменов, например: ["https://your-frontend.com"]
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))  # type: ignore
+router = APIRouter()
 
-ONE_TIME_TOKEN_TTL = int(os.getenv("ONE_TIME_TOKEN_TTL", 600))
 
-@app.post('/transcribe')
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Шаблон пути, а не сам путь: id задач не должны плодить временные ряды
+        route = request.scope.get("route")
+        HTTP_REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched",
+                                    str(status)).observe(time.perf_counter() - started)
+
+
+@router.get("/metrics")
+def metrics():
+    data, content_type = render_metrics()
+    return Response(content=data, media_type=content_type)
+
+@router.post('/transcribe')
 async def start_transcribe(query: TranscribeQuery, _: None = Depends(verify_service_token)):
-    return add_task(query)
+    return await add_task_async(query)
+
+
+@router.post('/transcribe/batch')
+async def start_transcribe_batch(query: TranscribeBatchQuery, _: None = Depends(verify_service_token)):
+    return await add_tasks_async(query.tasks)
+
 
+@router.post('/status/batch')
+async def get_transcribe_status_batch(query: StatusBatchQuery, _: None = Depends(verify_service_token)):
+    return {"items": await get_task_statuses_async(query.ids)}
 
-@app.get('/status/{task_id}')
+
+@router.get('/status/{task_id}')
 async def get_transcribe_status(task_id: str, _: None = Depends(verify_service_token)):
-    return get_task_status(task_id)
+    return await get_task_status_async(task_id)
 
 
-@app.get('/result/{task_id}')
+@router.get('/result/{task_id}')
 async def get_transcribe_result(task_id: str, _: None = Depends(verify_service_token)):
-    task = get_task(task_id)
+    task = await get_task_async(task_id)
     if not task:
         return {"error": "Задача не найдена"}
+    if task.status == TaskStatus.failed:
+        return {"error": "Задача завершилась с ошибкой", "detail": task.error}
     if task.status != TaskStatus.finished:
         return {"error": "Задача ещё не завершена"}
     return {"result_url": task.result_url}
 
-@app.get('/api/transcripts')
-def get_transcripts(user_id: str = Depends(get_current_user_id)):
-    tg_id = get_telegram_id_by_user_id(user_id=user_id)
-    if tg_id is None:
-        return []
-    tasks = get_tasks_by_user(str(tg_id))
-    return tasks
+def _sse(event: dict) -> str:
+    return f"event: progress\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
 
-@app.get('/api/transcripts/{transcript_id}')
-def get_transcript_by_id(transcript_id: str, user_id: str = Depends(get_current_user_id)):
-    task = get_task(transcript_id)
+
+async def _event_stream(queue: asyncio.Queue, snapshot: Optional[dict] = None, until_finished: bool = False,
+                        task_id: Optional[str] = None, telegram_id: Optional[int] = None):
+    try:
+        if snapshot is not None:
+            yield _sse(snapshot)
+            if until_finished and snapshot["status"] in FINAL_STATUSES:
+                return
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            yield _sse(event)
+            if until_finished and event["status"] in FINAL_STATUSES:
+                return
+    finally:
+        unsubscribe(queue, task_id=task_id, telegram_id=telegram_id)
+
+
+def _sse_response(stream) -> StreamingResponse:
+    return StreamingResponse(stream, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get('/events/{task_id}')
+async def task_events(task_id: str, _: None = Depends(verify_service_token)):
+    # Подписка раньше чтения снимка: событие между ними не потеряется
+    queue = subscribe(task_id=task_id)
+    snapshot = await get_task_progress_async(task_id)
+    if snapshot is None:
+        unsubscribe(queue, task_id=task_id)
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return _sse_response(_event_stream(queue, snapshot, until_finished=True, task_id=task_id))
+
+
+@router.get('/api/events')
+async def user_events(user_id: str = Depends(get_current_user_id)):
+    tg_id = await run_in_threadpool(get_telegram_id_by_user_id, user_id=user_id)
+    if tg_id is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    queue = subscribe(telegram_id=tg_id)
+    return _sse_response(_event_stream(queue, telegram_id=tg_id))
+
+
+@router.get('/api/transcripts')
+async def get_transcripts(
+    limit: int = Query(TRANSCRIPTS_PAGE_SIZE, ge=1, le=TRANSCRIPTS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, max_length=200),
+    user_id: str = Depends(get_current_user_id)
+):
+    tg_id = await run_in_threadpool(get_telegram_id_by_user_id, user_id=user_id)
+    if tg_id is None:
+        return {"items": [], "next_cursor": None}
+    try:
+        return await get_tasks_by_user_async(tg_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get('/api/search')
+async def search_transcripts(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+    user_id: str = Depends(get_current_user_id)
+):
+    tg_id = await run_in_threadpool(get_telegram_id_by_user_id, user_id=user_id)
+    if tg_id is None:
+        return {"items": [], "limit": limit, "offset": offset, "next_offset": None}
+    # Берём на одну запись больше, чтобы понять, есть ли следующая страница
+    hits = await search_segments_async(tg_id, q, limit + 1, offset)
+    next_offset = offset + limit if len(hits) > limit else None
+    return {"items": hits[:limit], "limit": limit, "offset": offset, "next_offset": next_offset}
+
+@router.get('/api/transcripts/{transcript_id}')
+async def get_transcript_by_id(transcript_id: str, user_id: str = Depends(get_current_user_id)):
+    task = await get_task_async(transcript_id)
     if not task:
         raise HTTPException(status_code=404, detail="Транскрибация не найдена")
     return task
 
+@router.post('/api/transcripts/{transcript_id}/export')
+async def export_transcript_file(transcript_id: str, query: ExportQuery,
+                                 user_id: str = Depends(get_current_user_id)):
+    task = await get_task_async(transcript_id)
+    tg_id = await run_in_threadpool(get_telegram_id_by_user_id, user_id=user_id)
+    if not task or task.telegram_id != tg_id:
+        raise HTTPException(status_code=404, detail="Транскрибация не найдена")
+    if task.status != TaskStatus.finished or not task.result_url:
+        raise HTTPException(status_code=409, detail="Задача ещё не завершена")
+    path = await export_transcript(task.result_url, query.speaker_names, query.format)
+    filename = f"{os.path.splitext(task.file_name)[0]}.{query.format}"
+    return FileResponse(path, media_type=MEDIA_TYPES[query.format], filename=filename)
+
 # 1. Создание одноразового токена (вызывает бот)
-@app.post("/token/one-time/create")
+@router.post("/token/one-time/create")
 def create_one_time_token(query: OneTimeTokenQuery, _: None = Depends(verify_service_token)):
     raw_token = secrets.token_urlsafe(32)
     token_hash = hashlib.sha256(raw_token.encode()).hexdigest()
@@ -99,83 +259,81 @@ def create_one_time_token(query: OneTimeTokenQuery, _: None = Depends(verify_ser
 
 
 # 2. Обмен одноразового токена на пару JWT (вызывает фронтенд)
-@app.post("/auth/one-time", response_model=TokenPair)
+@router.post("/auth/one-time", response_model=TokenPair)
 def auth_with_one_time(token: str):
     token_hash = hashlib.sha256(token.encode()).hexdigest()
-    record = get_one_time_token(token_hash)
-    if not record:
+    # Проверка, погашение токена и get-or-create пользователя — один запрос к базе
+    result = exchange_one_time_token(token_hash)
+    if result["status"] == "expired":
+        raise HTTPException(status_code=401, detail="Срок действия токена истёк")
+    if result["status"] != "ok":
         raise HTTPException(status_code=401, detail="Недействительный или уже использованный токен")
-
-    # Проверяем срок действия токена
-    expires_at_str = record.get("expires_at")
-    if expires_at_str:
-        expires_at = datetime.fromisoformat(expires_at_str)
-        if expires_at.tzinfo is None:
-            expires_at = expires_at.replace(tzinfo=timezone.utc)
-        if expires_at < datetime.now(timezone.utc):
-            delete_one_time_token(token_hash)
-            raise HTTPException(status_code=401, detail="Срок действия токена истёк")
-
-    telegram_id = record["telegram_id"]
-    user = get_user_by_telegram_id(telegram_id) or create_user(telegram_id)
+    user = result["user"]
 
     # Генерируем JWT-токены
     access_token = create_access_token(user["id"])
     refresh_token = create_refresh_token(user["id"])
 
-    # Сохраняем хэш refresh-токена
+    # Сохраняем хэш refresh-токена (старые токены пользователя удаляются там же).
+    # Второй запрос неизбежен: refresh-токен подписан id пользователя из первого
     refresh_hash = hashlib.sha256(refresh_token.encode()).hexdigest()
-    from auth.security import REFRESH_TOKEN_TTL  # late import to avoid circular
     save_refresh_token(refresh_hash, user["id"], REFRESH_TOKEN_TTL)
 
-    # Удаляем одноразовый токен
-    delete_one_time_token(token_hash)
-
     return TokenPair(access_token=access_token, refresh_token=refresh_token)
 
 
 # 3. Обновление пары токенов по refresh-токену
-@app.post("/auth/refresh", response_model=TokenPair)
+@router.post("/auth/refresh", response_model=TokenPair)
 def refresh_tokens(refresh_token: str):
     refresh_hash = hashlib.sha256(refresh_token.encode()).hexdigest()
-    record = get_refresh_token(refresh_hash)
-    if not record or record.get("revoked_at") is not None:
-        raise HTTPException(status_code=401, detail="Недействительный или отозванный refresh-токен")
 
-    # Проверяем срок действия токена
-    expires_at_str = record.get("expires_at")
-    if expires_at_str:
-        exp = datetime.fromisoformat(expires_at_str)
-        if exp.tzinfo is None:
-            exp = exp.replace(tzinfo=timezone.utc)
-        if exp < datetime.now(timezone.utc):
-            revoke_refresh_token(refresh_hash)
-            raise HTTPException(status_code=401, detail="Срок действия refresh-токена истёк")
-
-    from auth.security import _decode_token 
+    # Подпись и тип проверяются локально, без обращения к базе
     try:
         payload_data = _decode_token(refresh_token)
     except HTTPException:
-        revoke_refresh_token(refresh_hash)
-        raise
-
+        raise HTTPException(status_code=401, detail="Недействительный или отозванный refresh-токен")
     if payload_data.get("type") != "refresh":
         raise HTTPException(status_code=401, detail="Неверный тип токена")
 
     user_id = payload_data["sub"]
-
-    # Выполняем ротацию: отзываем старый refresh-токен и выпускаем новый
-    revoke_refresh_token(refresh_hash)
-
     new_access = create_access_token(user_id)
     new_refresh = create_refresh_token(user_id)
     new_refresh_hash = hashlib.sha256(new_refresh.encode()).hexdigest()
-    from auth.security import REFRESH_TOKEN_TTL
-    save_refresh_token(new_refresh_hash, user_id, REFRESH_TOKEN_TTL)
+
+    # Ротация одной транзакцией: проверка старого токена, отзыв и сохранение нового
+    status = rotate_refresh_token(refresh_hash, new_refresh_hash, user_id, REFRESH_TOKEN_TTL)
+    if status == "expired":
+        raise HTTPException(status_code=401, detail="Срок действия refresh-токена истёк")
+    if status != "ok":
+        raise HTTPException(status_code=401, detail="Недействительный или отозванный refresh-токен")
 
     return TokenPair(access_token=new_access, refresh_token=new_refresh)
 
+@router.get("/cache/stats")
+def get_cache_stats(_: None = Depends(verify_service_token)):
+    return cache_stats()
+
 # Новый защищённый эндпоинт, использующий заголовок Authorization
-@app.get("/me")
+@router.get("/me")
 def me(user_id: str = Depends(get_current_user_id)):
-    return {"user_id": user_id}
\ No newline at end of file
+    return {"user_id": user_id}
+
+
+def create_app() -> FastAPI:
+    # Импорт модуля ничего не подключает: пул базы, слушатель прогресса и фоновые
+    # задачи стартуют в lifespan, клиенты Supabase и экспорта — при первом запросе
+    app = FastAPI(lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["https://139.59.145.185"],  #список разрешённых доменов, например: ["https://your-frontend.com"]
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.middleware("http")(record_request_latency)
+    app.include_router(router)
+    return app
+
+
+# Настройки только из окружения процесса; с .env — через asgi:app
+app = create_app()